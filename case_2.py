@@ -1,3 +1,15 @@
+import heapq
+import random
+import sys
+import time
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 cases = [
     "5/4 0/2",
     "36/1 4 7 8 9 10 13 14 16 17 18 20 21 22 23 25 26 27 28 29 30 32 34 35/1",
@@ -35,31 +47,307 @@ def getInaccessibleFactory(n, factories):
     # If all cities have factories, the maximum distance is 0
     if len(factories) == n:
         return 0
-    
+
+    positions = sorted(factories)
+
+    # Cities before the first and after the last factory only have one side
+    max_distance = max(positions[0], n - 1 - positions[-1])
+
+    # A city between two factories is at most half of their gap away
+    for left, right in zip(positions, positions[1:]):
+        max_distance = max(max_distance, (right - left) // 2)
+
+    return max_distance
+
+
+def getInaccessibleFactories(cases):
+    """
+    Args:
+        cases (iterable): (n, factories) pairs
+    Returns:
+        list: getInaccessibleFactory result for every case, in order
+    """
+    return [getInaccessibleFactory(n, factories) for n, factories in cases]
+
+
+def getFactoryDistances(n, factories, chunk_size=1 << 20, use_numpy=True):
+    """
+    Args:
+        n (int): Total cities (0 to n-1)
+        factories (list): Cities with factories
+        chunk_size (int): Cities processed per step, bounds temporary memory
+        use_numpy (bool): Use NumPy when it is installed
+    Returns:
+        tuple: (distance to the nearest factory per city,
+                city of the nearest factory per city,
+                maximum distance)
+    """
+    if np is not None and use_numpy:
+        return _getFactoryDistancesNumpy(n, factories, chunk_size)
+    return _getFactoryDistancesPython(n, factories)
+
+
+def _getFactoryDistancesNumpy(n, factories, chunk_size):
+    positions = np.unique(np.asarray(factories, dtype=np.int64))
+    dtype = np.int32 if n < 2 ** 31 else np.int64
+    distances = np.empty(n, dtype=dtype)
+    nearest = np.empty(n, dtype=dtype)
+
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        cities = np.arange(start, stop, dtype=np.int64)
+
+        # First factory at or after each city, and the one before it
+        right = np.searchsorted(positions, cities)
+        left = positions[np.maximum(right - 1, 0)]
+        right = positions[np.minimum(right, len(positions) - 1)]
+
+        left_distance = np.abs(cities - left)
+        right_distance = np.abs(right - cities)
+        use_left = left_distance <= right_distance
+        distances[start:stop] = np.where(use_left, left_distance, right_distance)
+        nearest[start:stop] = np.where(use_left, left, right)
+
+    return distances, nearest, int(distances.max()) if n else 0
+
+
+def _getFactoryDistancesPython(n, factories):
+    is_factory = bytearray(n)
+    for factory in factories:
+        if 0 <= factory < n:
+            is_factory[factory] = 1
+
+    distances = array('q', [0]) * n
+    nearest = array('q', [0]) * n
+
+    # Forward pass: nearest factory on the left
+    before = [factory for factory in factories if factory < 0]
+    last = max(before) if before else None
+    for city in range(n):
+        if is_factory[city]:
+            last = city
+        if last is None:
+            distances[city] = -1
+        else:
+            distances[city] = city - last
+            nearest[city] = last
+
+    # Backward pass: keep the right one when it is strictly closer
+    after = [factory for factory in factories if factory >= n]
+    following = min(after) if after else None
+    for city in range(n - 1, -1, -1):
+        if is_factory[city]:
+            following = city
+        if following is not None and (
+            distances[city] < 0 or following - city < distances[city]
+        ):
+            distances[city] = following - city
+            nearest[city] = following
+
+    return distances, nearest, max(distances) if n else 0
+
+
+class FactoryNetwork:
+    """
+    Keeps the answer of getInaccessibleFactory up to date while factories
+    are opened and closed, instead of recomputing it from scratch.
+
+    Factory positions are kept in a sorted list and the gaps between
+    neighbouring factories in a max-heap. Gaps that no longer exist are
+    dropped lazily when they reach the top of the heap.
+    """
+
+    def __init__(self, n, factories=()):
+        self.n = n
+        self._positions = sorted(set(factories))
+        self._rebuild_gaps()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, city):
+        index = bisect_left(self._positions, city)
+        return index < len(self._positions) and self._positions[index] == city
+
+    def add_factory(self, city):
+        if city in self:
+            return
+
+        index = bisect_left(self._positions, city)
+        self._positions.insert(index, city)
+        # The gap between the new neighbours is replaced by two smaller ones
+        if index > 0:
+            self._push_gap(self._positions[index - 1], city)
+        if index + 1 < len(self._positions):
+            self._push_gap(city, self._positions[index + 1])
+
+    def remove_factory(self, city):
+        if city not in self:
+            raise ValueError(f"There is no factory in city {city}")
+
+        index = bisect_left(self._positions, city)
+        del self._positions[index]
+        if 0 < index < len(self._positions):
+            self._push_gap(self._positions[index - 1], self._positions[index])
+
+    def max_distance(self):
+        if not self._positions:
+            raise ValueError("At least one factory is required")
+
+        # Cities before the first and after the last factory only have one side
+        distance = max(self._positions[0], self.n - 1 - self._positions[-1])
+
+        while self._gaps and not self._is_gap(*self._gaps[0][1:]):
+            heapq.heappop(self._gaps)
+        if self._gaps:
+            distance = max(distance, -self._gaps[0][0] // 2)
+        return distance
+
+    def _rebuild_gaps(self):
+        self._gaps = [
+            (left - right, left, right)
+            for left, right in zip(self._positions, self._positions[1:])
+        ]
+        heapq.heapify(self._gaps)
+
+    def _push_gap(self, left, right):
+        heapq.heappush(self._gaps, (left - right, left, right))
+        # Keep stale gaps from piling up between max_distance calls
+        if len(self._gaps) > 4 * len(self._positions) + 16:
+            self._rebuild_gaps()
+
+    def _is_gap(self, left, right):
+        index = bisect_left(self._positions, left)
+        return (
+            index + 1 < len(self._positions)
+            and self._positions[index] == left
+            and self._positions[index + 1] == right
+        )
+
+
+def getInaccessibleFactoryBruteForce(n, factories):
+    """
+    Reference O(n * m) implementation used to verify the faster ones.
+    """
+    if len(factories) == n:
+        return 0
+
     max_distance = 0
-    
-    # For each city, calculate the distance to the nearest factory
     for city in range(n):
-        if city in factories:
-            continue  # Skip cities with factories
-            
-        # Calculate the distance to all factories
-        min_distance = float('inf')
-        for factory in factories:
-            # The distance between two cities is the absolute difference of their indices
-            distance = abs(city - factory)
-            min_distance = min(min_distance, distance)
-        
-        # Update the maximum distance to the nearest factory
+        min_distance = min(abs(city - factory) for factory in factories)
         max_distance = max(max_distance, min_distance)
-    
     return max_distance
 
 
+def parseCase(case):
+    n, c, a = case.split("/")
+    return int(n), list(map(int, c.split(" "))), int(a)
+
+
+def randomCase(rng, n, factory_count):
+    return n, rng.sample(range(n), factory_count)
+
+
+def timeIt(function, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark():
+    rng = random.Random(42)
+    parsed = [parseCase(case)[:2] for case in cases]
+
+    fast = timeIt(getInaccessibleFactories, parsed)
+    brute = timeIt(lambda: [getInaccessibleFactoryBruteForce(*c) for c in parsed])
+    print(f"Cases x{len(parsed)}: {fast * 1000:.3f} ms (brute force {brute * 1000:.3f} ms)")
+
+    for n, factory_count, with_brute in [
+        (5000, 2500, True),
+        (10 ** 5, 10, False),
+        (10 ** 5, 5 * 10 ** 4, False),
+        (10 ** 5, 10 ** 5 - 1, False),
+    ]:
+        case = randomCase(rng, n, factory_count)
+        line = f"n={n} m={factory_count}: {timeIt(getInaccessibleFactory, *case) * 1000:.3f} ms"
+        if with_brute:
+            line += f" (brute force {timeIt(getInaccessibleFactoryBruteForce, *case, repeat=1) * 1000:.3f} ms)"
+        print(line)
+
+    batch = [randomCase(rng, 1000, rng.randint(1, 1000)) for _ in range(1000)]
+    print(f"Batch of {len(batch)} cases (n=1000): {timeIt(getInaccessibleFactories, batch) * 1000:.3f} ms")
+
+    network = FactoryNetwork(10 ** 5, rng.sample(range(10 ** 5), 5 * 10 ** 4))
+    updates = [rng.randrange(10 ** 5) for _ in range(10 ** 4)]
+
+    def toggle():
+        for city in updates:
+            if city in network and len(network) > 1:
+                network.remove_factory(city)
+            else:
+                network.add_factory(city)
+            network.max_distance()
+
+    print(f"{len(updates)} incremental updates n=100000 m=50000: {timeIt(toggle, repeat=1) * 1000:.3f} ms")
+
+    for n, factory_count in [(10 ** 6, 1000), (10 ** 7, 10 ** 4)]:
+        case = randomCase(rng, n, factory_count)
+        if np is not None:
+            print(f"Distances n={n} m={factory_count} (NumPy): {timeIt(getFactoryDistances, *case) * 1000:.3f} ms")
+        python_time = timeIt(lambda: getFactoryDistances(*case, use_numpy=False), repeat=1)
+        print(f"Distances n={n} m={factory_count} (Python): {python_time * 1000:.3f} ms")
+
+
+def check(rounds=200, operations=200):
+    """
+    Compares every implementation against the brute force on random
+    factory layouts and random open/close sequences.
+    """
+    rng = random.Random(7)
+    for _ in range(rounds):
+        n = rng.randint(1, 60)
+        factories = rng.sample(range(n), rng.randint(1, n))
+        network = FactoryNetwork(n, factories)
+        current = set(factories)
+
+        for _ in range(operations):
+            city = rng.randrange(n)
+            if city in current and len(current) > 1:
+                network.remove_factory(city)
+                current.remove(city)
+            else:
+                network.add_factory(city)
+                current.add(city)
+
+            expected = getInaccessibleFactoryBruteForce(n, list(current))
+            results = {
+                "getInaccessibleFactory": getInaccessibleFactory(n, list(current)),
+                "getFactoryDistances": getFactoryDistances(n, list(current))[2],
+                "FactoryNetwork": network.max_distance(),
+            }
+            for name, result in results.items():
+                if result != expected:
+                    print(f"FAIL {name}: n={n} factories={sorted(current)} {result} != {expected}")
+                    return False
+
+    print(f"Random check: {rounds} layouts x {operations} operations OK")
+    return True
+
+
 if __name__ == "__main__":
+    if "--benchmark" in sys.argv:
+        benchmark()
+        sys.exit()
+
+    if "--check" in sys.argv:
+        sys.exit(0 if check() else 1)
+
     for i in range(len(cases)):
-        n, c, a = cases[i].split("/")
-        inaccessible = getInaccessibleFactory(int(n), list(map(int, c.split(" "))))
+        n, c, a = parseCase(cases[i])
+        inaccessible = getInaccessibleFactory(n, c)
         print(
-            f"Case {i + 1} [{inaccessible or '0'} == {a}]: {inaccessible == int(a) and 'OK' or 'FAIL'}"
+            f"Case {i + 1} [{inaccessible or '0'} == {a}]: {inaccessible == a and 'OK' or 'FAIL'}"
         )
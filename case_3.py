@@ -1,32 +1,303 @@
+import hashlib
+import os
+import re
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product, zip_longest
+
+ANSWER_PATTERN = re.compile(r"[^|\s]+")
+
+
+def iter_combinations(c, output="str"):
+    """
+    Returns the combinations of get_combinations lazily, in the same order.
+
+    Only one item index per group is kept in memory, so callers can stream
+    the product or stop early.
+
+    Args:
+        c (list): Groups (e.g: [['a','b'], ['1','2']])
+        output (str): "str" joins the items ('a1'), "tuple" keeps them (('a', '1'))
+    """
+    _check_output(output)
+    if output == "str":
+        return map("".join, product(*c))
+    return product(*c)
+
+
+def count_combinations(c):
+    """
+    Returns the number of combinations without generating them.
+    """
+    total = 1
+    for group in c:
+        total *= len(group)
+    return total
+
+
+def combination_at(c, index, output="str"):
+    """
+    Returns the combination at `index` in get_combinations order in O(n),
+    by decoding the index as a mixed-radix number (the last group changes
+    fastest). Negative indexes count from the end.
+    """
+    _check_output(output)
+    total = count_combinations(c)
+    if index < 0:
+        index += total
+    if not 0 <= index < total:
+        raise IndexError("combination index out of range")
+
+    items = [group[i] for group, i in zip(c, _decode_index(c, index))]
+    return "".join(items) if output == "str" else tuple(items)
+
+
+def combinations_slice(c, start=0, stop=None, output="str"):
+    """
+    Lazily yields the combinations in [start, stop), with the same bounds
+    handling as list slicing. Decodes `start` once and then advances the
+    indexes like an odometer, so a page costs O(n + page size).
+    """
+    _check_output(output)
+    start, stop, _ = slice(start, stop).indices(count_combinations(c))
+    return _iter_range(c, start, max(stop - start, 0), output)
+
+
+def _iter_range(c, start, count, output):
+    if not count:
+        return
+
+    indexes = _decode_index(c, start)
+    current = [group[i] for group, i in zip(c, indexes)]
+    for _ in range(count):
+        yield "".join(current) if output == "str" else tuple(current)
+
+        # Advance the last group and carry to the left
+        position = len(c) - 1
+        while position >= 0:
+            indexes[position] += 1
+            if indexes[position] < len(c[position]):
+                current[position] = c[position][indexes[position]]
+                break
+            indexes[position] = 0
+            current[position] = c[position][0]
+            position -= 1
+
+
+def iter_combinations_parallel(c, workers=None, chunk_size=100000, output="str"):
+    """
+    Generates the combinations in a process pool and yields them in order.
+
+    The product is split into index ranges of about `chunk_size`; at most
+    two chunks per worker are in flight so memory stays bounded when the
+    caller consumes slowly.
+    """
+    _check_output(output)
+    tasks = (
+        (_generate_chunk, c, prefix_groups, start, stop, output)
+        for prefix_groups, start, stop in _chunk_ranges(c, chunk_size)
+    )
+    for chunk in _map_in_order(tasks, workers):
+        yield from chunk
+
+
+def write_combinations(c, path, workers=None, chunk_size=100000):
+    """
+    Writes the combinations to `path`, one per line, generating the chunks
+    in a process pool. Returns the number of combinations written.
+    """
+    tasks = (
+        (_generate_block, c, prefix_groups, start, stop)
+        for prefix_groups, start, stop in _chunk_ranges(c, chunk_size)
+    )
+    with open(path, "w") as output_file:
+        for block in _map_in_order(tasks, workers):
+            output_file.write(block)
+    return count_combinations(c)
+
+
+def verify_combinations_parallel(c, expected, workers=None, chunk_size=100000):
+    """
+    Checks that `expected` holds exactly the combinations of `c` by
+    comparing order-independent fingerprints; every worker fingerprints
+    its own index range so no combination is sent back to the parent.
+    """
+    tasks = (
+        (_fingerprint_chunk, c, prefix_groups, start, stop)
+        for prefix_groups, start, stop in _chunk_ranges(c, chunk_size)
+    )
+    count, digest = 0, 0
+    for chunk_count, chunk_digest in _map_in_order(tasks, workers):
+        count += chunk_count
+        digest = (digest + chunk_digest) % 2 ** 64
+    return (count, digest) == fingerprint(expected)
+
+
+def fingerprint(combinations):
+    """
+    Returns (count, sum of 64-bit hashes), equal for equal multisets.
+    """
+    count, digest = 0, 0
+    for combination in combinations:
+        count += 1
+        digest += int.from_bytes(
+            hashlib.blake2b(combination.encode(), digest_size=8).digest(), "little"
+        )
+    return count, digest % 2 ** 64
+
+
+def _chunk_ranges(c, chunk_size):
+    """
+    Splits the product into mixed-radix ranges of whole suffix blocks.
+
+    The first `prefix_groups` groups are split by index range; the remaining
+    groups always run in full, so workers can generate them with
+    itertools.product instead of advancing indexes in Python.
+    """
+    if not count_combinations(c):
+        return
+
+    prefix_groups = 0
+    while count_combinations(c[prefix_groups:]) > chunk_size:
+        prefix_groups += 1
+
+    block = count_combinations(c[prefix_groups:])
+    prefixes = count_combinations(c[:prefix_groups])
+    per_chunk = max(1, chunk_size // block)
+    for start in range(0, prefixes, per_chunk):
+        yield prefix_groups, start, min(start + per_chunk, prefixes)
+
+
+def _iter_chunk(c, prefix_groups, start, stop, output="str"):
+    suffixes = list(iter_combinations(c[prefix_groups:], output))
+    for prefix in combinations_slice(c[:prefix_groups], start, stop, output):
+        for suffix in suffixes:
+            yield prefix + suffix
+
+
+def _map_in_order(tasks, workers):
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for function, *args in tasks:
+            pending.append(executor.submit(function, *args))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _generate_chunk(c, prefix_groups, start, stop, output):
+    return list(_iter_chunk(c, prefix_groups, start, stop, output))
+
+
+def _generate_block(c, prefix_groups, start, stop):
+    return "".join(
+        combination + "\n"
+        for combination in _iter_chunk(c, prefix_groups, start, stop)
+    )
+
+
+def _fingerprint_chunk(c, prefix_groups, start, stop):
+    return fingerprint(_iter_chunk(c, prefix_groups, start, stop))
+
+
+def _decode_index(c, index):
+    indexes = [0] * len(c)
+    for position in range(len(c) - 1, -1, -1):
+        index, indexes[position] = divmod(index, len(c[position]))
+    return indexes
+
+
+def _check_output(output):
+    if output not in ("str", "tuple"):
+        raise ValueError(f"Unknown output '{output}', use 'str' or 'tuple'")
+
+
 def get_combinations(n, c):
     # n: number of groups (2 < n < 7)
     # c: list of groups (e.g: [['a','b'], ['1','2']])
-    
-    def combine(groups, current=[]):
-        # Base case: If there are no more groups to process, return the current combination
-        if not groups:
-            return [current]
-        
-        # Recursive case: Select one element from each group and create combinations
-        result = []
-        current_group = groups[0]
-        remaining_groups = groups[1:]
-        
-        for item in current_group:
-            # Call the recursive function for each element
-            new_combinations = combine(remaining_groups, current + [item])
-            result.extend(new_combinations)
-            
-        return result
-
-    # Call the combine function from the main function and return the results
-    combinations = combine(c)
-    # Convert each combination to a string
-    return [''.join(combo) for combo in combinations]
+    return list(iter_combinations(c))
 
 
-if __name__ == "__main__":
-    with open("case_3.txt", "r") as cases_file:
+def verify_case(c, expected):
+    """
+    Compares the generated combinations with the `expected` iterable in a
+    single pass, without building a set of either side.
+
+    Both sides are walked in lockstep; when they come in the same order
+    nothing is buffered, otherwise unmatched items wait in two counters
+    until their counterpart shows up.
+
+    Returns:
+        tuple: (missing, extra) lists, expected but not generated and
+               generated but not expected
+    """
+    missing = Counter()
+    extra = Counter()
+    for generated, answer in zip_longest(iter_combinations(c), expected):
+        if generated == answer:
+            continue
+        if generated is not None:
+            _match(generated, missing, extra)
+        if answer is not None:
+            _match(answer, extra, missing)
+    return sorted((+missing).elements()), sorted((+extra).elements())
+
+
+def _match(item, waiting, unmatched):
+    if waiting[item]:
+        waiting[item] -= 1
+    else:
+        unmatched[item] += 1
+
+
+def iter_case_file(path="case_3.txt"):
+    """
+    Yields (groups, expected answers iterator) per line, reading the file
+    one line at a time and tokenizing the answers lazily.
+    """
+    with open(path, "r") as cases_file:
+        for line in cases_file:
+            if not line.strip():
+                continue
+            separator = line.index(",")
+            groups = [list(group) for group in line[:separator].strip().split("|")]
+            answers = (
+                match.group() for match in ANSWER_PATTERN.finditer(line, separator + 1)
+            )
+            yield groups, answers
+
+
+def verify_file(path="case_3.txt", show=5):
+    """
+    Verifies every case of the file with bounded memory and prints the
+    result, timing and a sample of the missing and extra combinations.
+    Returns True when every case passes.
+    """
+    passed = True
+    for i, (groups, answers) in enumerate(iter_case_file(path)):
+        start = time.perf_counter()
+        missing, extra = verify_case(groups, answers)
+        duration = (time.perf_counter() - start) * 1000
+
+        if not missing and not extra:
+            print(f"Case {i + 1} : OK ({count_combinations(groups)} combinations, {duration:.2f} ms)")
+            continue
+
+        passed = False
+        print(f"Case {i + 1} : FAIL ({len(missing)} missing, {len(extra)} extra, {duration:.2f} ms)")
+        if missing:
+            print(f"    missing: {', '.join(missing[:show])}")
+        if extra:
+            print(f"    extra: {', '.join(extra[:show])}")
+    return passed
+
+
+def read_cases(path="case_3.txt"):
+    with open(path, "r") as cases_file:
         cases = []
         solutions = []
         for line in cases_file:
@@ -34,11 +305,56 @@ if __name__ == "__main__":
                 c, a = line.strip().split(",")
                 cases.append([list(x) for x in c.split("|")])
                 solutions.append(a.split("|"))
+    return cases, solutions
+
+
+def benchmark_parallel(workers=None):
+    cases, solutions = read_cases()
+
+    start = time.perf_counter()
+    sequential = [fingerprint(iter_combinations(c)) == fingerprint(s) for c, s in zip(cases, solutions)]
+    sequential_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parallel = [
+        verify_combinations_parallel(c, s, workers, chunk_size=5000)
+        for c, s in zip(cases, solutions)
+    ]
+    parallel_time = time.perf_counter() - start
+    print(
+        f"case_3.txt ({sum(sequential)}/{len(cases)} OK, {sum(parallel)}/{len(cases)} OK): "
+        f"sequential {sequential_time * 1000:.1f} ms, parallel {parallel_time * 1000:.1f} ms "
+        f"(x{sequential_time / parallel_time:.2f})"
+    )
+
+    groups = [list("abcdefghijkl")] * 6
+    start = time.perf_counter()
+    sequential = fingerprint(iter_combinations(groups))
+    sequential_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tasks = (
+        (_fingerprint_chunk, groups, prefix_groups, a, b)
+        for prefix_groups, a, b in _chunk_ranges(groups, 100000)
+    )
+    parallel = [0, 0]
+    for count, digest in _map_in_order(tasks, workers):
+        parallel = [parallel[0] + count, (parallel[1] + digest) % 2 ** 64]
+    parallel_time = time.perf_counter() - start
+    print(
+        f"6 groups x 12 items ({count_combinations(groups)} combinations, "
+        f"{'OK' if tuple(parallel) == sequential else 'FAIL'}): "
+        f"sequential {sequential_time * 1000:.1f} ms, parallel {parallel_time * 1000:.1f} ms "
+        f"(x{sequential_time / parallel_time:.2f})"
+    )
+
+
+if __name__ == "__main__":
+    if "--parallel" in sys.argv:
+        benchmark_parallel()
+        sys.exit()
 
-        for i in range(len(cases)):
-            r = get_combinations(len(cases[i]), cases[i])
-            a = set("".join(x) for x in r)
-            b = set(solutions[i])
-            for x in a:
-                b.discard(x)
-            print(f"Case {i + 1} : {'OK' if len(b) == 0 else 'FAIL'}")
+    start = time.perf_counter()
+    passed = verify_file()
+    print(f"Total: {(time.perf_counter() - start) * 1000:.2f} ms")
+    sys.exit(0 if passed else 1)
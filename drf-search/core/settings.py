@@ -58,6 +58,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'location.middleware.LocationSearchCountMiddleware',
     'location.middleware.APILoggingMiddleware',
+    'location.middleware.QueryProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
@@ -88,9 +89,97 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': 'db.sqlite3'
-    }
+    },
+    # Read alias for location searches, lists and analytics. Points at the
+    # primary file locally; set DATABASE_REPLICA_NAME to use a real replica.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('DATABASE_REPLICA_NAME', 'db.sqlite3'),
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
+    # APILog rows only
+    'logs': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('DATABASE_LOGS_NAME', 'logs.sqlite3')
+    },
+}
+
+DATABASE_ROUTERS = ['location.routers.LocationRouter']
+
+# Aliases used by location.routers.LocationRouter
+LOCATION_DATABASES = {
+    'PRIMARY': 'default',
+    'READ': 'replica',
+    'LOGS': 'logs',
+}
+
+# Pragmas applied to every SQLite connection (see location/sqlite.py).
+# 'production' enables WAL, synchronous=NORMAL, mmap and a larger cache.
+# A database can override it with its own 'SQLITE_PROFILE' key.
+SQLITE_PROFILE = os.getenv('SQLITE_PROFILE', 'production')
+
+
+# Caches
+# The search cache is file based so every worker, and the warm_search_cache
+# command, share it
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'search': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('SEARCH_CACHE_LOCATION', os.path.join(BASE_DIR, 'cache', 'search')),
+        'TIMEOUT': 3600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+# Search result ids cached per model and normalized query, invalidated when
+# a location is saved or deleted (search counts are always read fresh).
+# Trending results change with every counted search and expire after
+# RANKED_TIMEOUT seconds instead
+SEARCH_CACHE = {
+    'ENABLED': True,
+    'ALIAS': 'search',
+    'RANKED_TIMEOUT': 60,
 }
 
+# Per-worker columnar copy of all locations used to build search and resolve
+# responses without model instances. Reloaded (in a background thread) when
+# names, codes or parents change, checked every REFRESH_INTERVAL seconds;
+# search counts are read again every CONDITIONAL_RESPONSES['COUNT_WINDOW'].
+LOCATION_CATALOGUE = {
+    'ENABLED': os.getenv('LOCATION_CATALOGUE') == 'True',
+    'REFRESH_INTERVAL': 5,
+    'BACKGROUND_RELOAD': True,
+}
+
+# Memory-mapped search index files written by build_search_index, used
+# instead of the search_text scan when present
+SEARCH_INDEX = {
+    'ENABLED': True,
+    'DIRECTORY': os.path.join(BASE_DIR, 'search_index'),
+}
+
+# Hourly search buckets behind /trending/ and search?rank=trending. A bucket
+# counts half as much every HALF_LIFE_HOURS; rollup_search_buckets merges
+# buckets older than ROLLUP_AFTER_HOURS into daily ones and deletes buckets
+# older than RETENTION_HOURS.
+TRENDING = {
+    'HALF_LIFE_HOURS': 24,
+    'ROLLUP_AFTER_HOURS': 48,
+    'RETENTION_HOURS': 24 * 30,
+}
+
+
+# Metrics files, search cache and search index go to a temporary directory
+# during tests
+TEST_RUNNER = 'location.test_runner.LocationTestRunner'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -120,6 +209,66 @@ SWAGGER_SETTINGS = {
     'DEEP_LINKING': True,
 }
 
+# Query profiling
+# BUDGETS maps url names (e.g. 'cities-search') to the maximum number of
+# queries a request may run. With STRICT enabled an exceeded budget raises
+# instead of logging a warning, which makes the test suite fail.
+# SERVER_TIMING exposes query counts and DB time to every client, so it is
+# only on in development.
+QUERY_PROFILING = {
+    'ENABLED': True,
+    'SERVER_TIMING': DEBUG == 'True',
+    'STRICT': os.getenv('QUERY_BUDGET_STRICT') == 'True',
+    'DEFAULT_BUDGET': None,
+    'BUDGETS': {},
+}
+
+# Location selection cookie, signed with SECRET_KEY so the parent ids it
+# carries can be trusted when counting
+LOCATION_SELECTION = {
+    'COOKIE_NAME': 'selected_location',
+    'MAX_AGE': 86400,  # 24 hours
+    'SIGNED': True,
+}
+
+# Which requests count the selected location: path regexes, and a
+# per-client window in which a selection is only counted once
+SEARCH_COUNTING = {
+    'INCLUDE': [r'^/api/'],
+    'EXCLUDE': [r'/select/$', r'/deselect/$', r'^/api/search-counts/$'],
+    'DEDUP_WINDOW': 300,  # seconds, 0 counts every request
+    'DEDUP_SIZE': 10000,
+}
+
+# ETag / Last-Modified on location and analytics responses, clients have
+# to revalidate but get a 304 while the underlying tables are unchanged.
+# Search counts do not change the tables' versions, the ETag changes every
+# COUNT_WINDOW seconds instead so counts in responses are at most that old
+# (0: counts are only refreshed by other changes).
+CONDITIONAL_RESPONSES = {
+    'ENABLED': True,
+    'COUNT_WINDOW': 60,
+    'CACHE_CONTROL': {'no_cache': True},
+}
+
+# Identical concurrent searches within a worker share one query, counted in
+# the location_search_total metric
+SEARCH_COALESCING = {
+    'ENABLED': True,
+}
+
+# Latency metrics
+# Every worker process writes its histograms to its own memory-mapped file in
+# DIRECTORY; /metrics sums all files. Clear the directory on deploy.
+# /metrics answers 404 to clients not in ALLOWED_IPS (REMOTE_ADDR, so list
+# the scraper or the proxy in front of it), None allows everyone.
+LATENCY_METRICS = {
+    'ENABLED': True,
+    'DIRECTORY': os.path.join(BASE_DIR, 'metrics'),
+    'ALLOWED_IPS': os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(','),
+    'BUCKETS': [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0],
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
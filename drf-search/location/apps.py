@@ -4,3 +4,24 @@ from django.apps import AppConfig
 class LocationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'location'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from .models import BaseLocationModel
+        from .registry import location_registry
+        from .search_cache import invalidate_instance_search_cache
+        from .sqlite import configure_sqlite_databases
+        from .versions import bump_instance_version
+
+        # SQLite pragma profile, before any connection is opened
+        configure_sqlite_databases()
+        location_registry.populate(BaseLocationModel)
+        for location_type in location_registry:
+            post_save.connect(bump_instance_version, sender=location_type.model)
+            post_delete.connect(bump_instance_version, sender=location_type.model)
+            post_save.connect(
+                invalidate_instance_search_cache, sender=location_type.model
+            )
+            post_delete.connect(
+                invalidate_instance_search_cache, sender=location_type.model
+            )
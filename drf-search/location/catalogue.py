@@ -0,0 +1,270 @@
+import array
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, models
+
+from .registry import location_registry
+from .versions import get_count_window, get_versions
+
+INTEGER_FIELDS = (models.AutoField, models.BigAutoField, models.IntegerField)
+STRING_FIELDS = (models.CharField, models.TextField)
+
+
+def get_catalogue_config():
+    return {
+        'ENABLED': False,
+        'REFRESH_INTERVAL': 5,  # seconds between version checks
+        # Rebuild a stale catalogue in a thread while requests keep using it
+        'BACKGROUND_RELOAD': True,
+        **getattr(settings, 'LOCATION_CATALOGUE', {}),
+    }
+
+
+class StringColumn:
+    """Strings stored in one UTF-8 buffer with offsets, decoded on access."""
+    __slots__ = ('data', 'offsets', 'nulls')
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array.array('q', [0])
+        self.nulls = set()
+
+    def append(self, value):
+        if value is None:
+            self.nulls.add(len(self))
+        else:
+            self.data += value.encode()
+        self.offsets.append(len(self.data))
+
+    def __getitem__(self, row):
+        if row in self.nulls:
+            return None
+        return self.data[self.offsets[row]:self.offsets[row + 1]].decode()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+class CatalogueTable:
+    """
+    One location model as columns: integers in arrays, strings in lists and
+    parents as row numbers into the parent's table.
+    """
+    __slots__ = (
+        'location_type', 'fields', 'parent_keys', 'columns', 'parents',
+        'row_by_code',
+    )
+
+    def __init__(self, location_type, tables):
+        from .serializers import location_serializer_for
+
+        model = location_type.model
+        self.location_type = location_type
+        self.fields = list(location_serializer_for(model).Meta.fields)
+        self.parent_keys = {
+            field.name: field.related_model._meta.model_name
+            for field in location_type.parent_fields
+        }
+        own_fields = [name for name in self.fields if name not in self.parent_keys]
+
+        self.columns = {}
+        for name in own_fields:
+            field = model._meta.get_field(name)
+            if isinstance(field, INTEGER_FIELDS):
+                self.columns[name] = array.array('q')
+            elif isinstance(field, STRING_FIELDS):
+                self.columns[name] = StringColumn()
+            else:
+                self.columns[name] = []
+        self.parents = {name: array.array('l') for name in self.parent_keys}
+        parent_tables = [tables[key] for key in self.parent_keys.values()]
+
+        rows = model.objects.order_by('pk').values_list(
+            *own_fields, *location_type.parent_attnames
+        )
+        own_columns = [self.columns[name] for name in own_fields]
+        parent_columns = list(self.parents.values())
+        for values in rows.iterator(chunk_size=10000):
+            for column, value in zip(own_columns, values):
+                column.append(value)
+            for column, table, parent_id in zip(
+                parent_columns, parent_tables, values[len(own_fields):]
+            ):
+                row = table.row_for_id(parent_id)
+                column.append(-1 if row is None else row)
+
+        codes = self.columns.get('code')
+        self.row_by_code = (
+            {codes[row]: row for row in range(len(codes))} if codes is not None else None
+        )
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def refresh_counts(self):
+        """Reads search_count into the existing column, one query."""
+        counts = self.columns.get('search_count')
+        if counts is None:
+            return
+        rows = self.location_type.model.objects.values_list('pk', 'search_count')
+        for pk, search_count in rows.iterator(chunk_size=10000):
+            row = self.row_for_id(pk)
+            if row is not None:
+                counts[row] = search_count
+
+    def row_for_id(self, pk):
+        # Rows are loaded ordered by id, no dict needed
+        ids = self.columns['id']
+        row = bisect.bisect_left(ids, pk) if pk is not None else len(ids)
+        if row < len(ids) and ids[row] == pk:
+            return row
+        return None
+
+    def row_for_code(self, code):
+        return self.row_by_code.get(code) if self.row_by_code is not None else None
+
+    def serialize(self, row, catalogue, fields=None, expand=None):
+        """Same output as the model serializer, fields/expand as in the views."""
+        data = {}
+        for name in self.fields:
+            if fields is not None and name not in fields:
+                continue
+            if name in self.parents:
+                parent_row = self.parents[name][row]
+                parent = catalogue.tables[self.parent_keys[name]]
+                if parent_row < 0:
+                    data[name] = None
+                elif expand is not None and name not in expand:
+                    data[name] = parent.columns['id'][parent_row]
+                else:
+                    data[name] = parent.serialize(parent_row, catalogue)
+            else:
+                data[name] = self.columns[name][row]
+        return data
+
+
+class LocationCatalogue:
+    """
+    Read-only copy of all location models used to build search and resolve
+    responses without instantiating model objects. Loaded once per worker
+    and reloaded when the table versions change (see get_catalogue).
+    """
+
+    def __init__(self):
+        self.versions = get_versions([lt.model for lt in location_registry])
+        self.counts_at = time.monotonic()
+        self.tables = {}
+        # Parents first, their row numbers are needed for the children
+        for location_type in location_registry:
+            self.tables[location_type.key] = CatalogueTable(location_type, self.tables)
+
+    def refresh_counts(self):
+        """Search counts change without a new version, read them again."""
+        self.counts_at = time.monotonic()
+        for table in self.tables.values():
+            table.refresh_counts()
+
+    def table(self, model):
+        return self.tables[model._meta.model_name]
+
+    def serialize_ids(self, model, ids, fields=None, expand=None):
+        """Serialized locations for the ids that exist, in the given order."""
+        table = self.table(model)
+        rows = [table.row_for_id(pk) for pk in ids]
+        return [
+            table.serialize(row, self, fields, expand)
+            for row in rows if row is not None
+        ]
+
+
+_catalogue = None
+_checked_at = None
+_reloader = None
+_lock = threading.Lock()
+
+
+def get_catalogue():
+    """
+    The worker's catalogue, None if disabled. Table versions are checked at
+    most every REFRESH_INTERVAL seconds. They only change with the content
+    (saves, deletes, search texts), search counts are read again every
+    CONDITIONAL_RESPONSES['COUNT_WINDOW'] seconds, the bound of the ETag. A
+    stale catalogue keeps being used while a thread rebuilds or refreshes
+    it, only the first load blocks a request.
+    """
+    global _catalogue, _checked_at, _reloader
+    config = get_catalogue_config()
+    if not config['ENABLED']:
+        return None
+
+    now = time.monotonic()
+    catalogue = _catalogue
+    if (
+        catalogue is not None
+        and _checked_at is not None
+        and now - _checked_at < config['REFRESH_INTERVAL']
+    ):
+        return catalogue
+
+    if not _lock.acquire(blocking=catalogue is None):
+        return catalogue
+    reloading = False
+    try:
+        _checked_at = now
+        if catalogue is None:
+            catalogue = _catalogue = LocationCatalogue()
+            return catalogue
+
+        if catalogue.versions != get_versions(
+            [location_type.model for location_type in location_registry]
+        ):
+            target = None
+        elif get_count_window() and now - catalogue.counts_at >= get_count_window():
+            target = catalogue
+        else:
+            return catalogue
+
+        if not config['BACKGROUND_RELOAD']:
+            _load(target)
+            return _catalogue
+        # The thread releases the lock when done
+        _reloader = threading.Thread(
+            target=_reload, args=(target,),
+            name='location-catalogue-reload', daemon=True
+        )
+        _reloader.start()
+        reloading = True
+        return catalogue
+    finally:
+        if not reloading:
+            _lock.release()
+
+
+def _load(catalogue=None):
+    # A new catalogue, or new search counts for the given one
+    global _catalogue
+    if catalogue is None:
+        _catalogue = LocationCatalogue()
+    else:
+        catalogue.refresh_counts()
+
+
+def _reload(catalogue=None):
+    try:
+        _load(catalogue)
+    finally:
+        connections.close_all()
+        _lock.release()
+
+
+def reset_catalogue():
+    global _catalogue, _checked_at
+    reloader = _reloader
+    if reloader is not None:
+        reloader.join()
+    with _lock:
+        _catalogue = None
+        _checked_at = None
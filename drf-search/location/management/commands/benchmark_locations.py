@@ -0,0 +1,420 @@
+import itertools
+import json
+import os
+import platform
+import random
+import string
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+from io import StringIO
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from rest_framework.test import APIRequestFactory
+
+from location.catalogue import LocationCatalogue, reset_catalogue
+from location.models import Country, City, Airport
+from location.profiling import RequestProfile, percentile
+from location.registry import location_registry
+from location.search_index import index_path, write_search_index
+from location.views import CountryViewSet, location_viewset_for
+
+SYLLABLES = [
+    'an', 'ka', 'ra', 'is', 'tan', 'bul', 'iz', 'mir', 'ant', 'al', 'ya',
+    'bur', 'sa', 'muğ', 'la', 'niğ', 'de', 'çan', 'ak', 'ka', 'le', 'şe',
+    'hir', 'ör', 'ün', 'ye', 'lon', 'don', 'man', 'ches', 'ter', 'york',
+]
+
+AIRPORT_CODES = 36 ** 3
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the location API against synthetic datasets in temporary '
+        'test databases and saves the results as JSON. The configured '
+        'databases are never written to.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[10000, 100000, 1000000],
+            help='Number of cities (and airports) to generate per run',
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=50,
+            help='Timed calls per endpoint',
+        )
+        parser.add_argument(
+            '--command-iterations',
+            type=int,
+            default=1,
+            help='Timed runs of the update_search_text command',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed for the generated data and queries',
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='Result file (default: benchmarks/<timestamp>-<commit>.json)',
+        )
+        parser.add_argument(
+            '--compare',
+            type=str,
+            help='Previous result file to compare against',
+        )
+
+    def handle(self, *args, **options):
+        self.factory = APIRequestFactory()
+        meta = self.get_meta(options)
+        results = {}
+
+        with self.benchmark_databases():
+            for size in options['sizes']:
+                self.stdout.write(f'Benchmarking {size} cities...')
+                with transaction.atomic():
+                    dataset = self.generate_dataset(size, options['seed'])
+                    operations = self.run_operations(dataset, options)
+                    transaction.set_rollback(True)
+
+                results[str(size)] = {
+                    'dataset': dataset['summary'],
+                    'operations': operations,
+                }
+                self.print_operations(operations)
+
+        output = options['output'] or self.get_default_output(meta)
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as output_file:
+            json.dump({'meta': meta, 'results': results}, output_file, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Results saved to {output}'))
+
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    @contextmanager
+    def benchmark_databases(self):
+        """
+        Creates test databases (migrated, as for the test suite) and points
+        every alias at them, SQLite ones as files in a temporary directory
+        so the numbers include disk access.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            for alias in connections:
+                settings_dict = connections[alias].settings_dict
+                if (
+                    connections[alias].vendor == 'sqlite'
+                    and not settings_dict['TEST'].get('MIRROR')
+                ):
+                    settings_dict['TEST']['NAME'] = os.path.join(
+                        directory, f'benchmark_{alias}.sqlite3'
+                    )
+            old_config = setup_databases(
+                verbosity=0, interactive=False, serialized_aliases=set()
+            )
+            try:
+                with override_settings(LATENCY_METRICS={
+                    **getattr(settings, 'LATENCY_METRICS', {}),
+                    'DIRECTORY': os.path.join(directory, 'metrics'),
+                }):
+                    yield
+            finally:
+                teardown_databases(old_config, verbosity=0)
+
+    def get_meta(self, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                capture_output=True, text=True, cwd=settings.BASE_DIR,
+            ).stdout.strip() or None
+        except OSError:
+            commit = None
+
+        return {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': commit,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'seed': options['seed'],
+            'iterations': options['iterations'],
+        }
+
+    def get_default_output(self, meta):
+        timestamp = meta['timestamp'][:19].replace(':', '').replace('-', '')
+        name = f"{timestamp}-{meta['commit'] or 'nocommit'}.json"
+        return os.path.join(settings.BASE_DIR, 'benchmarks', name)
+
+    def generate_dataset(self, size, seed):
+        rng = random.Random(seed)
+        started = time.perf_counter()
+
+        # Start from an empty dataset (the migrations add sample data)
+        Airport.objects.all().delete()
+        City.objects.all().delete()
+        Country.objects.all().delete()
+
+        country_count = min(max(size // 1000, 10), 26 ** 3)
+        country_codes = itertools.product(string.ascii_uppercase, repeat=3)
+        Country.objects.bulk_create(
+            [
+                Country(
+                    name=name,
+                    search_text=name,
+                    code=''.join(next(country_codes)),
+                    phone_code=f'+{index}',
+                    search_count=rng.randint(0, 1000),
+                )
+                for index, name in enumerate(
+                    self.make_name(rng) for _ in range(country_count)
+                )
+            ],
+            batch_size=5000,
+        )
+        countries = list(Country.objects.values_list('id', 'name', 'code'))
+
+        cities = []
+        for _ in range(size):
+            country_id, country_name, _ = rng.choice(countries)
+            name = self.make_name(rng)
+            cities.append(City(
+                name=name,
+                country_id=country_id,
+                search_text=f'{name},{country_name}',
+                search_count=rng.randint(0, 1000),
+            ))
+        City.objects.bulk_create(cities, batch_size=5000)
+        del cities
+
+        city_rows = list(
+            City.objects.values_list('id', 'name', 'country_id', 'country__name')
+        )
+        airport_codes = itertools.product(
+            string.ascii_uppercase + string.digits, repeat=3
+        )
+        airports = []
+        for _ in range(min(size, AIRPORT_CODES)):
+            city_id, city_name, country_id, country_name = rng.choice(city_rows)
+            name = f'{self.make_name(rng)} Airport'
+            airports.append(Airport(
+                name=name,
+                code=''.join(next(airport_codes)),
+                city_id=city_id,
+                country_id=country_id,
+                search_text=f'{name},{city_name},{country_name}',
+                search_count=rng.randint(0, 1000),
+            ))
+        Airport.objects.bulk_create(airports, batch_size=5000)
+        del airports
+
+        # Search for name fragments so queries return a mix of hit counts
+        queries = [
+            name[:rng.randint(3, 6)]
+            for _, name, _, _ in rng.sample(city_rows, min(100, len(city_rows)))
+        ]
+
+        return {
+            'rng': rng,
+            'queries': queries,
+            'country_codes': [code for _, _, code in countries],
+            'ids': {
+                'countries': [pk for pk, _, _ in countries],
+                'cities': [row[0] for row in city_rows],
+                'airports': list(Airport.objects.values_list('id', flat=True)),
+            },
+            'summary': {
+                'countries': country_count,
+                'cities': size,
+                'airports': min(size, AIRPORT_CODES),
+                'generation_seconds': round(time.perf_counter() - started, 2),
+            },
+        }
+
+    def make_name(self, rng):
+        name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        return name.capitalize()
+
+    def run_operations(self, dataset, options):
+        rng = dataset['rng']
+        iterations = options['iterations']
+        operations = {}
+
+        for location_type in location_registry:
+            basename = location_type.basename
+            if basename not in dataset['ids']:
+                continue
+            viewset = location_viewset_for(location_type.model)
+            search = viewset.as_view({'get': 'search'}, basename=basename)
+            select = viewset.as_view({'post': 'select'}, basename=basename)
+            ids = dataset['ids'][basename]
+
+            def call_search():
+                query = rng.choice(dataset['queries'])
+                return search(self.factory.get('/', {'q': query}))
+
+            def call_select():
+                return select(self.factory.post('/'), pk=rng.choice(ids))
+
+            # The plain search_text scan, then the same searches through a
+            # memory-mapped index built from the generated data
+            with override_settings(
+                SEARCH_CACHE={'ENABLED': False}, SEARCH_INDEX={'ENABLED': False}
+            ):
+                operations[f'{basename}.search'] = self.measure(call_search, iterations)
+            with tempfile.TemporaryDirectory() as directory:
+                write_search_index(index_path(directory, location_type), location_type)
+                with override_settings(
+                    SEARCH_CACHE={'ENABLED': False},
+                    SEARCH_INDEX={'ENABLED': True, 'DIRECTORY': directory},
+                ):
+                    operations[f'{basename}.search_index'] = self.measure(
+                        call_search, iterations
+                    )
+            with override_settings(
+                SEARCH_CACHE={'ENABLED': False},
+                SEARCH_INDEX={'ENABLED': False},
+                LOCATION_CATALOGUE={'ENABLED': True, 'REFRESH_INTERVAL': 3600},
+            ):
+                # Loaded by measure's first (untimed) run
+                reset_catalogue()
+                operations[f'{basename}.search_catalogue'] = self.measure(
+                    call_search, iterations
+                )
+                with tempfile.TemporaryDirectory() as directory:
+                    write_search_index(index_path(directory, location_type), location_type)
+                    with override_settings(
+                        SEARCH_INDEX={'ENABLED': True, 'DIRECTORY': directory}
+                    ):
+                        operations[f'{basename}.search_index_catalogue'] = self.measure(
+                            call_search, iterations
+                        )
+            reset_catalogue()
+            operations[f'{basename}.select'] = self.measure(call_select, iterations)
+
+        operations['catalogue.load'] = self.measure(LocationCatalogue, 1)
+        operations['catalogue.load']['retained_memory_kb'] = self.measure_catalogue_memory()
+
+        for action in ('most_searched_cities', 'search_ratio'):
+            view = CountryViewSet.as_view({'get': action}, basename='countries')
+
+            def call_action():
+                codes = rng.sample(dataset['country_codes'], 3)
+                return view(self.factory.get('/', {'country_code': ','.join(codes)}))
+
+            operations[f'countries.{action}'] = self.measure(call_action, iterations)
+
+        operations['update_search_text'] = self.measure(
+            lambda: call_command('update_search_text', stdout=StringIO(), verbosity=0),
+            options['command_iterations'],
+        )
+        return operations
+
+    def measure(self, call, iterations):
+        """
+        Runs `call` once to measure allocated memory, then times it while
+        counting queries. Rendering is included so the numbers match what a
+        client waits for.
+        """
+        def run():
+            response = call()
+            if hasattr(response, 'render'):
+                response.render()
+            if getattr(response, 'status_code', 200) >= 400:
+                raise CommandError(f'Benchmark call failed: {response.data}')
+
+        tracemalloc.start()
+        try:
+            run()
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        profile = RequestProfile()
+        latencies = []
+        with ExitStack() as stack:
+            for db in connections.all():
+                stack.enter_context(db.execute_wrapper(profile))
+            for _ in range(iterations):
+                started = time.perf_counter()
+                run()
+                latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+
+        return {
+            'iterations': iterations,
+            'queries_per_call': round(profile.query_count / iterations, 1),
+            'peak_memory_kb': round(peak_memory / 1024, 1),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'min_ms': round(latencies[0], 3),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'max_ms': round(latencies[-1], 3),
+        }
+
+    def measure_catalogue_memory(self):
+        """Memory kept by a loaded catalogue, per 100k location rows."""
+        tracemalloc.start()
+        try:
+            catalogue = LocationCatalogue()
+            retained, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        rows = sum(len(table) for table in catalogue.tables.values())
+        self.stdout.write(
+            f'  catalogue: {rows} rows, {retained / 1024:.1f}KB, '
+            f'{retained / 1024 / rows * 100000:.1f}KB per 100k rows'
+        )
+        return round(retained / 1024, 1)
+
+    def print_operations(self, operations):
+        for name, result in operations.items():
+            self.stdout.write(
+                f"  {name:<35} p50 {result['p50_ms']:>10.3f}ms "
+                f"p95 {result['p95_ms']:>10.3f}ms "
+                f"p99 {result['p99_ms']:>10.3f}ms "
+                f"queries {result['queries_per_call']:>6} "
+                f"memory {result['peak_memory_kb']:>10.1f}KB"
+            )
+
+    def compare(self, path, results):
+        with open(path) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+        self.stdout.write(f'Comparison with {path} (current / baseline):')
+        for size, result in results.items():
+            if size not in baseline:
+                continue
+            self.stdout.write(f'  {size} cities')
+            for name, current in result['operations'].items():
+                previous = baseline[size]['operations'].get(name)
+                if not previous:
+                    continue
+                ratios = ' '.join(
+                    f'{key[:-3]} x{current[key] / previous[key]:.2f}'
+                    if previous[key] else f'{key[:-3]} n/a'
+                    for key in ('p50_ms', 'p95_ms', 'p99_ms')
+                )
+                queries = (
+                    f"queries {previous['queries_per_call']}"
+                    f" -> {current['queries_per_call']}"
+                )
+                self.stdout.write(f'    {name:<35} {ratios} {queries}')
+
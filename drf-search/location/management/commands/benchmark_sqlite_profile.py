@@ -0,0 +1,223 @@
+import json
+import os
+import random
+import sqlite3
+import string
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from location.profiling import percentile
+from location.sqlite import SQLITE_PROFILES, apply_sqlite_pragmas
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures search read throughput under concurrent counter and log '
+        'writes for each SQLite profile'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profiles',
+            nargs='+',
+            choices=list(SQLITE_PROFILES),
+            default=['default', 'production'],
+            help='Profiles to compare',
+        )
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=100000,
+            help='Number of location rows',
+        )
+        parser.add_argument(
+            '--readers',
+            type=int,
+            default=4,
+            help='Concurrent search threads',
+        )
+        parser.add_argument(
+            '--writers',
+            type=int,
+            default=2,
+            help='Concurrent counter/log writer threads',
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=5.0,
+            help='Seconds to run each profile',
+        )
+        parser.add_argument(
+            '--directory',
+            type=str,
+            default=tempfile.gettempdir(),
+            help='Where the benchmark databases are created',
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='Optional JSON result file',
+        )
+
+    def handle(self, *args, **options):
+        results = {}
+        for profile in options['profiles']:
+            path = os.path.join(
+                options['directory'], f'benchmark_sqlite_{profile}.sqlite3'
+            )
+            self.stdout.write(f"Running '{profile}' profile...")
+            try:
+                self.create_database(path, profile, options['rows'])
+                results[profile] = self.run(path, profile, options)
+            finally:
+                for suffix in ('', '-wal', '-shm', '-journal'):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+
+            result = results[profile]
+            self.stdout.write(
+                f"  reads/s {result['reads_per_second']:>9.1f} "
+                f"read p95 {result['read_p95_ms']:>8.2f}ms "
+                f"writes/s {result['writes_per_second']:>9.1f} "
+                f"write p95 {result['write_p95_ms']:>8.2f}ms "
+                f"busy errors {result['busy_errors']}"
+            )
+
+        if 'default' in results:
+            baseline = results['default']['reads_per_second']
+            for profile, result in results.items():
+                if profile != 'default' and baseline:
+                    ratio = result['reads_per_second'] / baseline
+                    self.stdout.write(self.style.SUCCESS(
+                        f"'{profile}' read throughput: x{ratio:.2f} of 'default'"
+                    ))
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump(results, output_file, indent=2)
+
+    def connect(self, path, profile):
+        db = sqlite3.connect(
+            path, timeout=5, isolation_level=None, check_same_thread=False
+        )
+        cursor = db.cursor()
+        apply_sqlite_pragmas(cursor, SQLITE_PROFILES[profile])
+        cursor.close()
+        return db
+
+    def create_database(self, path, profile, rows):
+        rng = random.Random(42)
+        db = self.connect(path, profile)
+        db.executescript("""
+            CREATE TABLE location (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                search_text TEXT NOT NULL,
+                search_count INTEGER NOT NULL
+            );
+            CREATE TABLE apilog (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                status_code INTEGER NOT NULL,
+                response_time REAL NOT NULL,
+                created_at REAL NOT NULL
+            );
+        """)
+        names = (
+            ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 12)))
+            for _ in range(rows)
+        )
+        db.execute('BEGIN')
+        db.executemany(
+            'INSERT INTO location (name, search_text, search_count) '
+            'VALUES (?, ?, 0)',
+            ((name, f'{name},{name[:4]}') for name in names),
+        )
+        db.execute('COMMIT')
+        db.close()
+
+    def run(self, path, profile, options):
+        stop = threading.Event()
+        stats = {'reads': [], 'writes': [], 'busy_errors': 0}
+        lock = threading.Lock()
+
+        def reader(seed):
+            rng = random.Random(seed)
+            db = self.connect(path, profile)
+            latencies = []
+            while not stop.is_set():
+                query = ''.join(rng.choices(string.ascii_lowercase, k=3))
+                started = time.perf_counter()
+                try:
+                    db.execute(
+                        'SELECT id, name FROM location WHERE search_text LIKE ? '
+                        'ORDER BY name LIMIT 20',
+                        (f'%{query}%',),
+                    ).fetchall()
+                except sqlite3.OperationalError:
+                    with lock:
+                        stats['busy_errors'] += 1
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+            db.close()
+            with lock:
+                stats['reads'].extend(latencies)
+
+        def writer(seed):
+            # Mirrors the counter middleware and the API log: two autocommit
+            # statements per request
+            rng = random.Random(seed)
+            db = self.connect(path, profile)
+            latencies = []
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    db.execute(
+                        'UPDATE location SET search_count = search_count + 1 '
+                        'WHERE id = ?',
+                        (rng.randint(1, options['rows']),),
+                    )
+                    db.execute(
+                        'INSERT INTO apilog (path, status_code, response_time, '
+                        'created_at) VALUES (?, 200, ?, ?)',
+                        ('/api/cities/search/', rng.random(), time.time()),
+                    )
+                except sqlite3.OperationalError:
+                    with lock:
+                        stats['busy_errors'] += 1
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+            db.close()
+            with lock:
+                stats['writes'].extend(latencies)
+
+        threads = [
+            threading.Thread(target=reader, args=(seed,))
+            for seed in range(options['readers'])
+        ] + [
+            threading.Thread(target=writer, args=(1000 + seed,))
+            for seed in range(options['writers'])
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['duration'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        reads = sorted(stats['reads'])
+        writes = sorted(stats['writes'])
+        return {
+            'reads': len(reads),
+            'writes': len(writes),
+            'reads_per_second': len(reads) / options['duration'],
+            'writes_per_second': len(writes) / options['duration'],
+            'read_p95_ms': percentile(reads, 95),
+            'write_p95_ms': percentile(writes, 95),
+            'busy_errors': stats['busy_errors'],
+        }
+
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from location.registry import location_registry
+from location.search_index import get_search_index_config, index_path, write_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        'Writes the memory-mapped search index files that workers use instead '
+        'of scanning search_text, run after the data or search texts change'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model',
+            type=str,
+            choices=['all'] + location_registry.keys(),
+            default='all',
+            help='Specify which model to index',
+        )
+        parser.add_argument(
+            '--directory',
+            type=str,
+            help='Output directory, defaults to SEARCH_INDEX["DIRECTORY"]',
+        )
+
+    def handle(self, *args, **options):
+        directory = options['directory'] or get_search_index_config()['DIRECTORY']
+        for location_type in location_registry:
+            if options['model'] not in ['all', location_type.key]:
+                continue
+            started = time.perf_counter()
+            path = index_path(directory, location_type)
+            count = write_search_index(path, location_type)
+            self.stdout.write(self.style.SUCCESS(
+                f'Indexed {count} {location_type.label} in '
+                f'{time.perf_counter() - started:.2f}s ({path})'
+            ))
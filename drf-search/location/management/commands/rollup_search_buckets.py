@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from location.trending import get_trending_config, rollup_buckets
+
+
+class Command(BaseCommand):
+    help = (
+        'Merges old hourly trending buckets into daily ones and deletes '
+        'buckets past the retention period, run periodically (e.g. daily)'
+    )
+
+    def handle(self, *args, **options):
+        config = get_trending_config()
+        merged, deleted = rollup_buckets()
+        self.stdout.write(self.style.SUCCESS(
+            f'Merged {merged} hourly buckets older than '
+            f"{config['ROLLUP_AFTER_HOURS']}h into daily buckets, deleted "
+            f"{deleted} buckets older than {config['RETENTION_HOURS']}h"
+        ))
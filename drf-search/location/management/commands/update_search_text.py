@@ -1,6 +1,8 @@
 from django.core.management.base import BaseCommand
 from django.db import transaction
-from location.models import Country, City, Airport
+from location.registry import location_registry
+from location.search_cache import invalidate_search_cache
+from location.versions import bump_versions
 from tqdm import tqdm
 
 
@@ -16,22 +18,19 @@ class Command(BaseCommand):
         parser.add_argument(
             '--model',
             type=str,
-            choices=['all', 'country', 'city', 'airport'],
+            choices=['all'] + location_registry.keys(),
             default='all',
             help='Specify which model to update',
         )
 
     def handle(self, *args, **options):
+        self.show_progress = options['verbosity'] > 0
         try:
             with transaction.atomic():
-                if options['model'] in ['all', 'country']:
-                    self.update_countries(options['dry_run'])
-                
-                if options['model'] in ['all', 'city']:
-                    self.update_cities(options['dry_run'])
-                
-                if options['model'] in ['all', 'airport']:
-                    self.update_airports(options['dry_run'])
+                # Parents come first in the registry
+                for location_type in location_registry:
+                    if options['model'] in ['all', location_type.key]:
+                        self.update_model(location_type, options['dry_run'])
 
                 if options['dry_run']:
                     self.stdout.write(
@@ -47,51 +46,23 @@ class Command(BaseCommand):
                 )
                 raise e
 
-    def update_countries(self, dry_run):
-        countries = Country.objects.all()
-        self.stdout.write('Updating Countries...')
-        
-        updates = []
-        for country in tqdm(countries, desc='Countries'):
-            country.search_text = country.name
-            updates.append(country)
-
-        if not dry_run:
-            Country.objects.bulk_update(updates, ['search_text'])
-            self.stdout.write(
-                self.style.SUCCESS(f'Updated {len(updates)} Countries')
-            )
+    def update_model(self, location_type, dry_run):
+        model = location_type.model
+        objects = model.objects.all()
+        # select_related() without paths would follow every foreign key
+        if location_type.select_related:
+            objects = objects.select_related(*location_type.select_related)
+        self.stdout.write(f'Updating {location_type.label}...')
 
-    def update_cities(self, dry_run):
-        cities = City.objects.select_related('country').all()
-        self.stdout.write('Updating Cities...')
-        
         updates = []
-        for city in tqdm(cities, desc='Cities'):
-            city.search_text = f"{city.name},{city.country.name}"
-            updates.append(city)
+        for instance in tqdm(objects, desc=location_type.label, disable=not self.show_progress):
+            instance.search_text = location_registry.build_search_text(instance)
+            updates.append(instance)
 
         if not dry_run:
-            City.objects.bulk_update(updates, ['search_text'])
+            model.objects.bulk_update(updates, ['search_text'])
+            bump_versions(model)
+            invalidate_search_cache(model)
             self.stdout.write(
-                self.style.SUCCESS(f'Updated {len(updates)} Cities')
+                self.style.SUCCESS(f'Updated {len(updates)} {location_type.label}')
             )
-
-    def update_airports(self, dry_run):
-        airports = Airport.objects.select_related('city', 'country').all()
-        self.stdout.write('Updating Airports...')
-        
-        updates = []
-        for airport in tqdm(airports, desc='Airports'):
-            airport.search_text = (
-                f"{airport.name},"
-                f"{airport.city.name},"
-                f"{airport.country.name}"
-            )
-            updates.append(airport)
-
-        if not dry_run:
-            Airport.objects.bulk_update(updates, ['search_text'])
-            self.stdout.write(
-                self.style.SUCCESS(f'Updated {len(updates)} Airports')
-            ) 
\ No newline at end of file
@@ -0,0 +1,107 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.db.models.fields.json import KT
+from django.utils import timezone
+
+from location.models import APILog
+from location.registry import location_registry
+from location.search_cache import warm_search
+
+
+class Command(BaseCommand):
+    help = (
+        'Pre-populates the search cache with the most frequent recent search '
+        'queries from APILog, run before a new deploy takes traffic'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=float,
+            default=24,
+            help='Only use searches logged in the last N hours',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=200,
+            help='Most frequent queries to warm per model',
+        )
+        parser.add_argument(
+            '--time-budget',
+            type=float,
+            default=60,
+            help='Stop after this many seconds',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        queries = self.get_frequent_queries(options['hours'], options['limit'])
+        self.stdout.write(f'Found {len(queries)} frequent search queries')
+
+        warmed = skipped = 0
+        for location_type, query, count in queries:
+            if time.perf_counter() - started > options['time_budget']:
+                self.stdout.write(self.style.WARNING(
+                    f'Time budget of {options["time_budget"]}s reached, '
+                    f'{len(queries) - warmed - skipped} queries left'
+                ))
+                break
+            if warm_search(location_type.model.objects.all(), query):
+                warmed += 1
+            else:
+                skipped += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Warmed {warmed} searches ({skipped} already cached) '
+            f'in {time.perf_counter() - started:.2f}s'
+        ))
+
+    def get_frequent_queries(self, hours, limit):
+        """
+        [(location type, query, count)], most frequent first across models.
+        Queries with the same search terms are merged.
+        """
+        paths = {
+            f'/api/{location_type.basename}/search/': location_type
+            for location_type in location_registry
+        }
+        rows = (
+            APILog.objects
+            .filter(
+                path__in=paths,
+                method='GET',
+                status_code=200,
+                created_at__gte=timezone.now() - timedelta(hours=hours),
+                request_data__has_key='q',
+            )
+            .exclude(request_data__q='')
+            .annotate(query=KT('request_data__q'))
+            .values('path', 'query')
+            .annotate(count=Count('id'))
+        )
+
+        merged = {}
+        for row in rows.iterator():
+            location_type = paths[row['path']]
+            terms = location_type.model.objects.get_queryset().get_search_terms(row['query'])
+            key = (location_type.key, terms)
+            query, count = merged.get(key, (row['query'], 0))
+            merged[key] = (query, count + row['count'])
+
+        per_model = {}
+        for (key, _), (query, count) in merged.items():
+            per_model.setdefault(key, []).append((query, count))
+
+        queries = []
+        for key, entries in per_model.items():
+            entries.sort(key=lambda entry: -entry[1])
+            location_type = location_registry.get(key)
+            queries.extend(
+                (location_type, query, count) for query, count in entries[:limit]
+            )
+        queries.sort(key=lambda entry: -entry[2])
+        return queries
@@ -1,25 +1,100 @@
+from django.core.exceptions import FieldDoesNotExist
 from django.db import models
-from django.db.models import Q
 from unidecode import unidecode
 
 
 class LocationQuerySet(models.QuerySet):
-    def search(self, query):
+    search_limit = 20
+
+    def search(self, query, rank=None):
+        """
+        Up to 20 matching locations. An exact code ("IST", "TR") is looked up
+        on its unique index and listed first, the search_text scan only fills
+        the remaining places.
+        """
+        if not query:
+            return []
+
+        normalized_query, code = self.get_search_terms(query)
+        results = list(self.filter(code=code)[:1]) if code else []
+        return results + list(
+            self.search_scan(normalized_query, rank, [location.pk for location in results])
+        )
+
+    def search_ids(self, query, rank=None):
+        """Ids of search(query, rank) in result order, no model instances."""
         if not query:
+            return []
+
+        normalized_query, code = self.get_search_terms(query)
+        ids = self.code_match_ids(code)
+        return ids + list(
+            self.search_scan(normalized_query, rank, ids).values_list('pk', flat=True)
+        )
+
+    def code_match_ids(self, code):
+        """[id] of the location with this code (unique index), or []."""
+        if not code:
+            return []
+        return list(self.filter(code=code).values_list('pk', flat=True)[:1])
+
+    def search_scan(self, normalized_query, rank=None, exclude_ids=()):
+        """search_text matches, without the already found exclude_ids."""
+        limit = self.search_limit - len(exclude_ids)
+        if limit <= 0:
             return self.none()
-            
-        # Normalize search query
-        normalized_query = unidecode(query.lower())
-        
+
+        queryset = self.filter(search_text__icontains=normalized_query)
+        if exclude_ids:
+            queryset = queryset.exclude(pk__in=exclude_ids)
+        ordering = ['name']
+        # 'trending': recently searched locations first instead of by name
+        if rank == 'trending':
+            from location.trending import trend_score_subquery
+            from location.registry import location_registry
+
+            queryset = queryset.annotate(trend_score=trend_score_subquery(
+                location_registry.for_model(self.model)
+            ))
+            ordering.insert(0, '-trend_score')
+        elif rank is not None:
+            raise ValueError(f"Unknown search ranking '{rank}'")
+
         # Use basic LIKE query for SQLite
-        return self.filter(
-            Q(search_text__icontains=normalized_query)
-        ).order_by('name')[:20]
+        return queryset.order_by(*ordering)[:limit]
+
+    def get_search_terms(self, query):
+        """
+        (normalized query, code) used by search(), queries with equal terms
+        return the same results.
+        """
+        # Normalize search query
+        return unidecode(query.lower()), self.get_code_query(query)
+
+    def get_code_field(self):
+        """The unique `code` field, None for models without codes."""
+        try:
+            return self.model._meta.get_field('code')
+        except FieldDoesNotExist:
+            return None
+
+    def get_code_query(self, query):
+        """Upper-cased query if it looks like a code of this model, else None."""
+        field = self.get_code_field()
+        if field is None:
+            return None
+        code = query.strip()
+        if 2 <= len(code) <= field.max_length and code.isascii() and code.isalpha():
+            return code.upper()
+        return None
 
 
 class LocationManager(models.Manager):
     def get_queryset(self):
         return LocationQuerySet(self.model, using=self._db)
     
-    def search(self, query):
-        return self.get_queryset().search(query) 
\ No newline at end of file
+    def search(self, query, rank=None):
+        return self.get_queryset().search(query, rank)
+
+    def search_ids(self, query, rank=None):
+        return self.get_queryset().search_ids(query, rank)
\ No newline at end of file
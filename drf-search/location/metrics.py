@@ -0,0 +1,279 @@
+import bisect
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+from django.conf import settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LATENCY_METRIC = 'api_request_duration_seconds'
+SEARCH_METRIC = 'location_search_total'
+
+
+class MmapedDict:
+    """
+    A dict of float values backed by a memory-mapped file.
+
+    Every worker process writes to its own file, so updates need no locking
+    between processes and readers aggregate all files in the directory.
+
+    Layout: an 8 byte header holding the number of used bytes, followed by
+    entries of [4 byte key length][utf-8 key padded to 8 bytes][8 byte double].
+    """
+    initial_size = 1024 * 64
+
+    def __init__(self, filename):
+        self._file = open(filename, 'a+b')
+        capacity = os.fstat(self._file.fileno()).st_size
+        if capacity == 0:
+            capacity = self.initial_size
+            self._file.truncate(capacity)
+        self._capacity = capacity
+        self._mmap = mmap.mmap(self._file.fileno(), self._capacity)
+        self._positions = {}
+
+        self._used = struct.unpack_from('i', self._mmap, 0)[0]
+        if self._used == 0:
+            self._used = 8
+            struct.pack_into('i', self._mmap, 0, self._used)
+        else:
+            for key, _, position in _read_entries(self._mmap, self._used):
+                self._positions[key] = position
+
+    def inc(self, key, amount):
+        position = self._positions.get(key)
+        if position is None:
+            position = self._init_value(key)
+        value = struct.unpack_from('d', self._mmap, position)[0]
+        struct.pack_into('d', self._mmap, position, value + amount)
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def _init_value(self, key):
+        encoded = key.encode('utf-8')
+        padded = encoded + b' ' * (8 - (len(encoded) + 4) % 8)
+        entry = struct.pack(f'i{len(padded)}sd', len(encoded), padded, 0.0)
+
+        while self._used + len(entry) > self._capacity:
+            self._capacity *= 2
+            self._file.truncate(self._capacity)
+            self._mmap.close()
+            self._mmap = mmap.mmap(self._file.fileno(), self._capacity)
+
+        self._mmap[self._used:self._used + len(entry)] = entry
+        self._used += len(entry)
+        # Publish the entry only after it has been written
+        struct.pack_into('i', self._mmap, 0, self._used)
+
+        position = self._used - 8
+        self._positions[key] = position
+        return position
+
+
+def _read_entries(data, used):
+    position = 8
+    while position < used:
+        key_length = struct.unpack_from('i', data, position)[0]
+        position += 4
+        key = bytes(data[position:position + key_length]).decode('utf-8')
+        position += key_length + (8 - (key_length + 4) % 8)
+        value = struct.unpack_from('d', data, position)[0]
+        yield key, value, position
+        position += 8
+
+
+def read_values(directory):
+    """Sums the values of every worker file in the directory."""
+    values = {}
+    for filename in glob.glob(os.path.join(directory, '*.db')):
+        with open(filename, 'rb') as metrics_file:
+            data = metrics_file.read()
+        if len(data) < 8:
+            continue
+        used = struct.unpack_from('i', data, 0)[0]
+        for key, value, _ in _read_entries(data, used):
+            values[key] = values.get(key, 0.0) + value
+    return values
+
+
+class ProcessMetric:
+    """Base for metrics that write to a per-process MmapedDict file."""
+    file_prefix = 'metric'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._store = None
+        self._pid = None
+
+    def _get_store(self):
+        # Forked workers must not share the parent's file
+        pid = os.getpid()
+        if self._store is None or self._pid != pid:
+            os.makedirs(self.directory, exist_ok=True)
+            self._store = MmapedDict(
+                os.path.join(self.directory, f'{self.file_prefix}_{pid}.db')
+            )
+            self._pid = pid
+        return self._store
+
+
+class LatencyHistogram(ProcessMetric):
+    """
+    Fixed-bucket latency histogram per route and status class.
+
+    Observations cost a bisect over the (small, fixed) bucket list and two
+    in-place updates of the memory-mapped store.
+    """
+    file_prefix = 'latency'
+
+    def __init__(self, directory, buckets=DEFAULT_BUCKETS):
+        super().__init__(directory)
+        self.buckets = tuple(sorted(buckets))
+        self._keys = {}
+
+    def observe(self, route, status_code, duration):
+        labels = (route, f'{status_code // 100}xx')
+        keys = self._keys.get(labels)
+        if keys is None:
+            keys = self._keys[labels] = self._make_keys(*labels)
+
+        bucket_key = keys[bisect.bisect_left(self.buckets, duration)]
+        with self._lock:
+            store = self._get_store()
+            store.inc(bucket_key, 1)
+            store.inc(keys[-1], duration)
+
+    def collect(self):
+        """Returns {(route, status_class): (bucket counts, sum)} for all workers."""
+        series = {}
+        for key, value in read_values(self.directory).items():
+            metric, *labels = json.loads(key)
+            if metric != LATENCY_METRIC:
+                continue
+            route, status_class, bucket = labels
+            counts, total = series.get(
+                (route, status_class), ([0] * (len(self.buckets) + 1), 0.0)
+            )
+            if bucket == 'sum':
+                total += value
+            elif bucket < len(counts):
+                counts[bucket] += int(value)
+            series[(route, status_class)] = (counts, total)
+        return series
+
+    def render(self):
+        lines = [
+            f'# HELP {LATENCY_METRIC} API request latency in seconds.',
+            f'# TYPE {LATENCY_METRIC} histogram',
+        ]
+        bounds = [_format_bound(bound) for bound in self.buckets] + ['+Inf']
+        for (route, status_class), (counts, total) in sorted(self.collect().items()):
+            labels = f'route="{route}",status="{status_class}"'
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(
+                    f'{LATENCY_METRIC}_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f'{LATENCY_METRIC}_sum{{{labels}}} {total}')
+            lines.append(f'{LATENCY_METRIC}_count{{{labels}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    def _make_keys(self, route, status_class):
+        # One key per bucket (the last one is +Inf) followed by the sum key
+        buckets = list(range(len(self.buckets) + 1)) + ['sum']
+        return tuple(
+            json.dumps([LATENCY_METRIC, route, status_class, bucket])
+            for bucket in buckets
+        )
+
+
+class Counter(ProcessMetric):
+    """Monotonic counter with a fixed set of label names."""
+    file_prefix = 'counters'
+
+    def __init__(self, directory, name, description, label_names):
+        super().__init__(directory)
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._keys = {}
+
+    def inc(self, amount=1, **labels):
+        values = tuple(labels[name] for name in self.label_names)
+        key = self._keys.get(values)
+        if key is None:
+            key = self._keys[values] = json.dumps([self.name, *values])
+        with self._lock:
+            self._get_store().inc(key, amount)
+
+    def collect(self):
+        """Returns {label values: total} for all workers."""
+        series = {}
+        for key, value in read_values(self.directory).items():
+            metric, *values = json.loads(key)
+            if metric == self.name and len(values) == len(self.label_names):
+                series[tuple(values)] = series.get(tuple(values), 0.0) + value
+        return series
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} counter',
+        ]
+        for values, total in sorted(self.collect().items()):
+            labels = ','.join(
+                f'{name}="{value}"' for name, value in zip(self.label_names, values)
+            )
+            lines.append(f'{self.name}{{{labels}}} {total}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_bound(bound):
+    return repr(float(bound))
+
+
+_latency_histogram = None
+_search_counter = None
+
+
+def get_metrics_directory():
+    config = getattr(settings, 'LATENCY_METRICS', {})
+    return config.get('DIRECTORY', os.path.join(settings.BASE_DIR, 'metrics'))
+
+
+def get_latency_histogram():
+    global _latency_histogram
+    config = getattr(settings, 'LATENCY_METRICS', {})
+    directory = get_metrics_directory()
+    buckets = tuple(sorted(config.get('BUCKETS', DEFAULT_BUCKETS)))
+
+    histogram = _latency_histogram
+    if (
+        histogram is None
+        or histogram.directory != directory
+        or histogram.buckets != buckets
+    ):
+        histogram = _latency_histogram = LatencyHistogram(directory, buckets)
+    return histogram
+
+
+def get_search_counter():
+    """Searches per location type that ran or were served by a concurrent one."""
+    global _search_counter
+    directory = get_metrics_directory()
+    counter = _search_counter
+    if counter is None or counter.directory != directory:
+        counter = _search_counter = Counter(
+            directory,
+            SEARCH_METRIC,
+            'Location searches by outcome (executed or coalesced).',
+            ['model', 'outcome'],
+        )
+    return counter
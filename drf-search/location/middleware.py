@@ -1,49 +1,85 @@
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
 from django.http import HttpResponse
-from .models import Country, City, Airport, APILog
+from .models import APILog
+from .metrics import get_latency_histogram
+from .profiling import QueryBudgetExceeded, RequestProfile
+from .registry import location_registry
+from .selection import RecentSelections, get_selection
+import re
 import time
 import logging
 
 logger = logging.getLogger('api')
 
+def get_client_ip(request):
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[0]
+    return request.META.get('REMOTE_ADDR')
+
+
 class LocationSearchCountMiddleware:
+    """
+    Counts the selected location on successful requests.
+
+    Only paths matching SEARCH_COUNTING['INCLUDE'] and none of 'EXCLUDE' are
+    counted, and each client counts a selection at most once per
+    'DEDUP_WINDOW' seconds. Select counts itself and starts that window.
+    """
+
     def __init__(self, get_response):
         self.get_response = get_response
+        config = getattr(settings, 'SEARCH_COUNTING', {})
+        self.include = [re.compile(pattern) for pattern in config.get('INCLUDE', [r'^/api/'])]
+        self.exclude = [re.compile(pattern) for pattern in config.get('EXCLUDE', [])]
+        self.recent = RecentSelections(
+            max_size=config.get('DEDUP_SIZE', 10000),
+            window=config.get('DEDUP_WINDOW', 300),
+        )
 
     def __call__(self, request):
         response = self.get_response(request)
         
-        # Only process if response is successful
-        if not isinstance(response, HttpResponse) or response.status_code != 200:
+        # Only process if response is successful, a 304 from a conditional
+        # request counts like the 200 it stands for
+        if (
+            not isinstance(response, HttpResponse)
+            or response.status_code not in (200, 304)
+        ):
             return response
 
-        self._increment_search_counts(request)
+        selection = getattr(response, 'selection', None)
+        if selection is not None:
+            # Already counted by select, only recorded
+            self.recent.should_count((get_client_ip(request), selection.encode()))
+        elif self.should_count_path(request.path):
+            self._increment_search_counts(request)
         return response
 
-    def _increment_search_counts(self, request):
-        model_cookie_mapping = {
-            'selected_country': Country,
-            'selected_city': City,
-            'selected_airport': Airport,
-        }
+    def should_count_path(self, path):
+        return (
+            any(pattern.search(path) for pattern in self.include)
+            and not any(pattern.search(path) for pattern in self.exclude)
+        )
 
-        for cookie_name, model in model_cookie_mapping.items():
-            location_id = request.COOKIES.get(cookie_name)
-            if location_id:
-                try:
-                    instance = model.objects.get(id=location_id)
-                    instance.increment_search_count()
-                    
-                    # Increment parent models' search count
-                    if hasattr(instance, 'country'):
-                        instance.country.increment_search_count()
-                    if hasattr(instance, 'city'):
-                        instance.city.increment_search_count()
-                except model.DoesNotExist:
-                    pass
+    def _increment_search_counts(self, request):
+        # The cookie carries the parent ids, nothing has to be read
+        selection = get_selection(request)
+        if selection is None:
+            return
+        if not self.recent.should_count((get_client_ip(request), selection.encode())):
+            return
+        location_registry.increment_chain(
+            selection.location_type, selection.pk, selection.parent_ids
+        )
 
 class APILoggingMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
+        config = getattr(settings, 'LATENCY_METRICS', {})
+        self.metrics_enabled = config.get('ENABLED', True)
 
     def __call__(self, request):
         start_time = time.time()
@@ -61,8 +97,15 @@ class APILoggingMiddleware:
                 user_agent=request.META.get('HTTP_USER_AGENT'),
                 ip_address=self.get_client_ip(request),
                 request_data=self.get_request_data(request),
-                response_data=self.get_response_data(response)
+                response_data=self.get_response_data(response),
+                **self.get_profile_data(request)
             )
+
+            # Metrics
+            if self.metrics_enabled:
+                get_latency_histogram().observe(
+                    self.get_route(request), response.status_code, duration
+                )
             
             # File Log
             logger.info(
@@ -74,11 +117,12 @@ class APILoggingMiddleware:
         
         return response
 
+    def get_route(self, request):
+        match = request.resolver_match
+        return match.url_name if match and match.url_name else 'unmatched'
+
     def get_client_ip(self, request):
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            return x_forwarded_for.split(',')[0]
-        return request.META.get('REMOTE_ADDR')
+        return get_client_ip(request)
 
     def get_request_data(self, request):
         if request.method in ['POST', 'PUT', 'PATCH']:
@@ -89,4 +133,77 @@ class APILoggingMiddleware:
         try:
             return response.data
         except AttributeError:
-            return None 
\ No newline at end of file
+            return None
+
+    def get_profile_data(self, request):
+        profile = getattr(request, 'profile', None)
+        if profile is None:
+            return {}
+        return {
+            'query_count': profile.query_count,
+            'db_time': profile.db_time_ms,
+            'serializer_time': profile.get_timing_ms('serialize'),
+            'render_time': profile.get_timing_ms('render'),
+        }
+
+
+class QueryProfilingMiddleware:
+    """
+    Records query count, DB time, serializer time and render time per request.
+
+    Results are attached to the request as `request.profile`, emitted as a
+    `Server-Timing` header and checked against the configured query budgets.
+    Must be placed after `APILoggingMiddleware` so the log row is written
+    with the final numbers and is not counted itself.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = getattr(settings, 'QUERY_PROFILING', {})
+        self.enabled = config.get('ENABLED', True)
+        self.server_timing = config.get('SERVER_TIMING', settings.DEBUG)
+        self.strict = config.get('STRICT', False)
+        self.default_budget = config.get('DEFAULT_BUDGET')
+        self.budgets = config.get('BUDGETS', {})
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        profile = request.profile = RequestProfile()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+            response = self.get_response(request)
+
+        if self.server_timing:
+            response['Server-Timing'] = profile.server_timing()
+
+        self._check_budget(request, profile)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook returns
+        start = time.perf_counter()
+
+        def record_render_time(rendered_response):
+            request.profile.add_timing('render', time.perf_counter() - start)
+
+        if hasattr(request, 'profile'):
+            response.add_post_render_callback(record_render_time)
+        return response
+
+    def _check_budget(self, request, profile):
+        match = request.resolver_match
+        url_name = match.url_name if match else None
+        budget = self.budgets.get(url_name, self.default_budget)
+        if budget is None or profile.query_count <= budget:
+            return
+
+        message = (
+            f"{request.method} {request.path} ({url_name}) executed "
+            f"{profile.query_count} queries, budget is {budget}"
+        )
+        if self.strict:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message) 
\ No newline at end of file
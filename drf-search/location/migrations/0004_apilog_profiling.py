@@ -0,0 +1,33 @@
+# Generated by Django 5.1.5 on 2026-10-19 17:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('location', '0003_apilog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apilog',
+            name='db_time',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='apilog',
+            name='query_count',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='apilog',
+            name='render_time',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='apilog',
+            name='serializer_time',
+            field=models.FloatField(null=True),
+        ),
+    ]
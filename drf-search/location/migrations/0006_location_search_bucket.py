@@ -0,0 +1,28 @@
+# Generated by Django 5.1.5 on 2026-10-19 17:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('location', '0005_location_table_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationSearchBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('location_type', models.CharField(max_length=64)),
+                ('location_id', models.BigIntegerField()),
+                ('country_id', models.BigIntegerField(null=True)),
+                ('hour', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['location_type', 'country_id', 'hour'], name='location_lo_locatio_b721a8_idx')],
+                'constraints': [models.UniqueConstraint(fields=('location_type', 'location_id', 'hour'), name='unique_location_search_bucket')],
+            },
+        ),
+    ]
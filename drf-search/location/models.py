@@ -12,8 +12,14 @@ class BaseLocationModel(models.Model):
         abstract = True
 
     def increment_search_count(self):
-        self.search_count += 1
-        self.save()
+        """
+        Counts a search of this location and its parents like the API does,
+        without saving (no new table version or search cache generation).
+        """
+        from location.registry import location_registry
+
+        location_registry.increment_instance_search_count(self)
+        self.refresh_from_db(fields=['search_count'])
 
 class Country(BaseLocationModel):
     code = models.CharField(max_length=3, unique=True)
@@ -64,6 +70,49 @@ class APILog(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     request_data = models.JSONField(null=True)
     response_data = models.JSONField(null=True)
+    query_count = models.IntegerField(null=True)
+    db_time = models.FloatField(null=True)  # ms type
+    serializer_time = models.FloatField(null=True)  # ms type
+    render_time = models.FloatField(null=True)  # ms type
 
     class Meta:
         ordering = ['-created_at']
+
+class LocationTableVersion(models.Model):
+    """
+    Per-table version of a location model, bumped on saves, deletes and
+    search text updates (not on search counts) so conditional GETs can be
+    answered without running the main query.
+    """
+    table = models.CharField(max_length=64, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.table} v{self.version}"
+
+class LocationSearchBucket(models.Model):
+    """
+    Searches of one location in one hour (or one day once rolled up), used
+    for the time-decayed trending score next to the all-time search_count.
+    """
+    location_type = models.CharField(max_length=64)
+    location_id = models.BigIntegerField()
+    # Country of the location (the country itself for countries)
+    country_id = models.BigIntegerField(null=True)
+    hour = models.IntegerField()  # hours since the epoch
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['location_type', 'location_id', 'hour'],
+                name='unique_location_search_bucket',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['location_type', 'country_id', 'hour']),
+        ]
+
+    def __str__(self):
+        return f"{self.location_type} {self.location_id} @{self.hour}: {self.count}"
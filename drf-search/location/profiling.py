@@ -0,0 +1,68 @@
+import time
+from contextlib import contextmanager
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestProfile:
+    """
+    Collects per-request database and rendering timings.
+
+    An instance is installed with `connection.execute_wrapper` so every
+    query executed while the request is being handled is counted.
+    """
+
+    def __init__(self):
+        self.query_count = 0
+        self.db_time = 0.0
+        self.timings = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.query_count += 1
+
+    def add_timing(self, name, duration):
+        self.timings[name] = self.timings.get(name, 0.0) + duration
+
+    def get_timing_ms(self, name):
+        if name not in self.timings:
+            return None
+        return self.timings[name] * 1000
+
+    @property
+    def db_time_ms(self):
+        return self.db_time * 1000
+
+    def server_timing(self):
+        entries = [
+            f'db;dur={self.db_time_ms:.2f};desc="{self.query_count} queries"'
+        ]
+        for name, duration in self.timings.items():
+            entries.append(f'{name};dur={duration * 1000:.2f}')
+        return ', '.join(entries)
+
+
+@contextmanager
+def profile_section(request, name):
+    """Adds the time spent inside the block to the request profile."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile = getattr(request, 'profile', None)
+        if profile is not None:
+            profile.add_timing(name, time.perf_counter() - start)
+
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, -(-len(sorted_values) * percent // 100) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
@@ -0,0 +1,275 @@
+from django.core.exceptions import ValidationError
+from django.db import router, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from .trending import add_counts, record_searches, search_rows
+
+
+class LocationType:
+    """
+    A concrete location model and its parent chain, resolved once at startup.
+    """
+
+    def __init__(self, model, parent_fields, select_related, ancestors):
+        self.model = model
+        self.key = model._meta.model_name
+        self.basename = str(model._meta.verbose_name_plural).lower().replace(' ', '_')
+        self.label = str(model._meta.verbose_name_plural).title()
+        # Foreign keys to other location models, most specific first
+        # (Airport: city, country)
+        self.parent_fields = parent_fields
+        self.parent_attnames = [field.attname for field in parent_fields]
+        # Paths needed to load the whole chain in one query
+        # (Airport: city, city__country, country)
+        self.select_related = select_related
+        # Every location counted along with this one, direct or not, most
+        # specific first, as (lookup path, model)
+        # (Station with only a city FK: city, city__country)
+        self.ancestors = ancestors
+        self.ancestor_paths = [path for path, _ in ancestors]
+        self.ancestor_models = [model for _, model in ancestors]
+
+    def ancestor_ids(self, instance):
+        """Ids of the ancestors, without queries for loaded parents."""
+        ids = []
+        for path in self.ancestor_paths:
+            *names, last = path.split('__')
+            related = instance
+            for name in names:
+                related = getattr(related, name)
+                if related is None:
+                    break
+            ids.append(
+                None if related is None
+                else getattr(related, related._meta.get_field(last).attname)
+            )
+        return ids
+
+    def __repr__(self):
+        return f'<LocationType {self.key}>'
+
+
+class LocationRegistry:
+    """
+    Every concrete BaseLocationModel subclass, so new location models like
+    Station get search text, counters, selection and endpoints automatically.
+    """
+
+    def __init__(self):
+        self._types = {}
+        self._by_model = {}
+
+    def populate(self, base_model):
+        models = [
+            model for model in _subclasses(base_model)
+            if not model._meta.abstract and not model._meta.proxy
+        ]
+        parents = {
+            model: [
+                field for field in model._meta.concrete_fields
+                if field.many_to_one and field.related_model in models
+            ]
+            for model in models
+        }
+
+        depths = {}
+
+        def depth(model):
+            if model not in depths:
+                depths[model] = 1 + max(
+                    (depth(field.related_model) for field in parents[model]),
+                    default=-1
+                )
+            return depths[model]
+
+        def related_paths(model, prefix=''):
+            paths = []
+            for field in parents[model]:
+                paths.append(prefix + field.name)
+                paths.extend(related_paths(field.related_model, f'{prefix}{field.name}__'))
+            return paths
+
+        def ancestors(model):
+            # Shortest path to every model up the chain
+            paths = {}
+            for path in related_paths(model):
+                related = model
+                for name in path.split('__'):
+                    related = related._meta.get_field(name).related_model
+                if related not in paths or path.count('__') < paths[related].count('__'):
+                    paths[related] = path
+            return sorted(
+                [(path, related) for related, path in paths.items()],
+                key=lambda item: -depth(item[1])
+            )
+
+        self._types = {}
+        self._by_model = {}
+        # Top level models (Country) first, so parents are processed first
+        for model in sorted(models, key=depth):
+            parent_fields = sorted(
+                parents[model], key=lambda field: -depth(field.related_model)
+            )
+            location_type = LocationType(
+                model, parent_fields, related_paths(model), ancestors(model)
+            )
+            self._types[location_type.key] = location_type
+            self._by_model[model] = location_type
+
+    def __iter__(self):
+        return iter(self._types.values())
+
+    def __len__(self):
+        return len(self._types)
+
+    def keys(self):
+        return list(self._types)
+
+    def get(self, key):
+        return self._types[key]
+
+    def for_model(self, model):
+        return self._by_model[model]
+
+    def build_search_text(self, instance):
+        """Own name followed by the parents' names: 'airport,city,country'."""
+        location_type = self.for_model(type(instance))
+        names = [instance.name] + [
+            getattr(instance, field.name).name
+            for field in location_type.parent_fields
+        ]
+        return ','.join(names)
+
+    def increment_search_count(self, model, pk):
+        """
+        Increments the search count of a location and all of its ancestors.
+        Returns False if the location does not exist.
+        """
+        location_type = self.for_model(model)
+        try:
+            pk = model._meta.pk.to_python(pk)
+        except ValidationError:
+            return False
+
+        if not location_type.ancestors:
+            if not self._increment(model, pk):
+                return False
+            record_searches(location_type, pk, [])
+            return True
+
+        parent_ids = model.objects.filter(pk=pk).values_list(
+            *location_type.ancestor_paths
+        ).first()
+        if parent_ids is None:
+            return False
+        self.increment_chain(location_type, pk, parent_ids)
+        return True
+
+    def increment_instance_search_count(self, instance):
+        """Same as increment_search_count, using the loaded parents."""
+        location_type = self.for_model(type(instance))
+        self.increment_chain(
+            location_type, instance.pk, location_type.ancestor_ids(instance)
+        )
+
+    def increment_chain(self, location_type, pk, parent_ids):
+        """
+        Increments a location and the given ancestor ids without reading
+        them, one UPDATE per model in a single transaction, and adds the
+        search to their trending buckets.
+        """
+        using = router.db_for_write(location_type.model)
+        with transaction.atomic(using=using):
+            self._increment(location_type.model, pk)
+            for model, parent_id in zip(location_type.ancestor_models, parent_ids):
+                if parent_id is not None:
+                    self._increment(model, parent_id)
+            record_searches(location_type, pk, parent_ids)
+
+    def apply_search_counts(self, entries):
+        """
+        Adds (location_type, pk, delta) entries to the locations and their
+        ancestors, for counts collected elsewhere. Reads one query per location
+        type, then writes one UPDATE ... CASE per model and the trending
+        buckets in batched upserts, in one transaction. Returns
+        the given entries whose location does not exist, duplicates
+        included; nothing is applied for them.
+        """
+        by_type = {}
+        for location_type, pk, delta in entries:
+            by_type.setdefault(location_type, {}).setdefault(pk, 0)
+            by_type[location_type][pk] += delta
+
+        missing_pks = set()
+        deltas = {}
+        bucket_rows = []
+        for location_type, pk_deltas in by_type.items():
+            chains = {
+                pk: parent_ids
+                for pk, *parent_ids in location_type.model.objects.filter(
+                    pk__in=list(pk_deltas)
+                ).values_list('pk', *location_type.ancestor_paths)
+            }
+            for pk, delta in pk_deltas.items():
+                if pk not in chains:
+                    missing_pks.add((location_type, pk))
+                    continue
+                model_deltas = deltas.setdefault(location_type.model, {})
+                model_deltas[pk] = model_deltas.get(pk, 0) + delta
+                for model, parent_id in zip(location_type.ancestor_models, chains[pk]):
+                    if parent_id is not None:
+                        parent_deltas = deltas.setdefault(model, {})
+                        parent_deltas[parent_id] = parent_deltas.get(parent_id, 0) + delta
+                bucket_rows += search_rows(location_type, pk, chains[pk], count=delta)
+
+        if deltas:
+            using = router.db_for_write(next(iter(deltas)))
+            with transaction.atomic(using=using):
+                for model, model_deltas in deltas.items():
+                    self._add(model, model_deltas)
+                add_counts(_merge_rows(bucket_rows))
+        # Entries were merged by location above, report them as given
+        return [
+            (location_type, pk, delta)
+            for location_type, pk, delta in entries
+            if (location_type, pk) in missing_pks
+        ]
+
+    def _add(self, model, deltas, batch_size=500):
+        # Locations with the same delta share a WHEN
+        pks_by_delta = {}
+        for pk, delta in deltas.items():
+            pks_by_delta.setdefault(delta, []).append(pk)
+        groups = sorted(pks_by_delta.items())
+        for start in range(0, len(groups), batch_size):
+            batch = groups[start:start + batch_size]
+            model.objects.filter(
+                pk__in=[pk for delta, pks in batch for pk in pks]
+            ).update(search_count=F('search_count') + Case(
+                *[When(pk__in=pks, then=Value(delta)) for delta, pks in batch],
+                default=Value(0),
+                output_field=IntegerField(),
+            ))
+
+    def _increment(self, model, pk):
+        updated = model.objects.filter(pk=pk).update(
+            search_count=F('search_count') + 1
+        )
+        return updated > 0
+
+
+def _merge_rows(rows):
+    # The same parent can be reached from many entries
+    counts = {}
+    for location_type, location_id, country_id, hour, count in rows:
+        key = (location_type, location_id, country_id, hour)
+        counts[key] = counts.get(key, 0) + count
+    return [(*key, count) for key, count in counts.items()]
+
+
+def _subclasses(model):
+    for subclass in model.__subclasses__():
+        yield subclass
+        yield from _subclasses(subclass)
+
+
+location_registry = LocationRegistry()
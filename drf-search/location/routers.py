@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class LocationRouter:
+    """
+    Routes location reads (search, list, analytics) to the read alias,
+    counter and other writes to the primary and APILog to its own database.
+
+    Reads go to the primary while it is inside a transaction so code that
+    writes and reads in the same atomic block sees its own writes.
+    """
+
+    def __init__(self):
+        config = getattr(settings, 'LOCATION_DATABASES', {})
+        self.primary = config.get('PRIMARY', DEFAULT_DB_ALIAS)
+        self.read = config.get('READ', self.primary)
+        self.logs = config.get('LOGS', self.primary)
+
+    def is_log_model(self, model):
+        return (
+            model._meta.app_label == 'location'
+            and model._meta.model_name == 'apilog'
+        )
+
+    def is_location_model(self, model):
+        return model._meta.app_label == 'location' and not self.is_log_model(model)
+
+    def db_for_read(self, model, **hints):
+        if self.is_log_model(model):
+            return self.logs
+        if self.is_location_model(model):
+            if connections[self.primary].in_atomic_block:
+                return self.primary
+            return self.read
+        return None
+
+    def db_for_write(self, model, **hints):
+        if self.is_log_model(model):
+            return self.logs
+        if self.is_location_model(model):
+            return self.primary
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The read alias is a copy of the primary
+        if self.is_location_model(obj1) and self.is_location_model(obj2):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == self.read and self.read != self.primary:
+            return False
+        if app_label == 'location' and model_name == 'apilog':
+            return db == self.logs
+        if db == self.logs and self.logs != self.primary:
+            return False
+        return None
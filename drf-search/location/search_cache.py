@@ -0,0 +1,152 @@
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import connections, router, transaction
+
+from .registry import location_registry
+from .search_index import search_ids
+from .versions import table_key
+
+
+def get_search_cache_config():
+    return {
+        'ENABLED': True,
+        'ALIAS': 'search',
+        'RANKED_TIMEOUT': 60,
+        **getattr(settings, 'SEARCH_CACHE', {}),
+    }
+
+
+def get_search_cache():
+    return caches[get_search_cache_config()['ALIAS']]
+
+
+def _generation_key(model):
+    # Keyed by database so test or other databases never share entries. The
+    # write alias is used for reads too: the read alias changes inside
+    # transactions and a replica has another NAME.
+    database = connections[router.db_for_write(model)].settings_dict['NAME']
+    digest = hashlib.blake2b(str(database).encode(), digest_size=8).hexdigest()
+    return f'search:{digest}:{table_key(model)}:generation'
+
+
+def get_generation(model):
+    cache = get_search_cache()
+    key = _generation_key(model)
+    generation = cache.get(key)
+    if generation is None:
+        # A new generation instead of a counter, an evicted key must not
+        # bring back old entries
+        cache.add(key, time.time_ns(), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def invalidate_search_cache(*models):
+    """
+    Starts a new generation once the current transaction commits, so a
+    search running meanwhile cannot cache the old results under it.
+    """
+    for model in set(models):
+        transaction.on_commit(
+            functools.partial(_new_generation, model),
+            using=router.db_for_write(model)
+        )
+
+
+def _new_generation(model):
+    get_search_cache().set(_generation_key(model), time.time_ns(), timeout=None)
+
+
+def invalidate_instance_search_cache(sender, instance, **kwargs):
+    """post_save/post_delete receiver for location models."""
+    invalidate_search_cache(sender)
+
+
+def make_search_key(model, terms, rank=None):
+    if rank is not None:
+        terms = (*terms, rank)
+    digest = hashlib.blake2b(repr(terms).encode(), digest_size=16).hexdigest()
+    return f'search:{table_key(model)}:{get_generation(model)}:{digest}'
+
+
+def get_timeout(rank=None):
+    # Counted searches change ranked results without a new generation, so
+    # they are only kept for a short time
+    if rank is None:
+        return DEFAULT_TIMEOUT
+    return get_search_cache_config()['RANKED_TIMEOUT']
+
+
+def cached_search(queryset, query, rank=None):
+    """
+    queryset.search(query, rank) as a list, using cached result ids when possible.
+
+    Only the ids of the matches are cached: a hit replaces the search_text
+    scan by a primary key lookup and the rows (search counts included) are
+    always read fresh.
+    """
+    if not get_search_cache_config()['ENABLED']:
+        return _search(queryset, query, rank)
+
+    cache = get_search_cache()
+    key = make_search_key(queryset.model, queryset.get_search_terms(query), rank)
+    ids = cache.get(key)
+    if ids is None:
+        results = _search(queryset, query, rank)
+        cache.set(key, [location.pk for location in results], get_timeout(rank))
+        return results
+    return _fetch(queryset, ids)
+
+
+def cached_search_ids(queryset, query, rank=None):
+    """Ids of queryset.search(query, rank) in result order, no model instances."""
+    if not get_search_cache_config()['ENABLED']:
+        return _search_ids(queryset, query, rank)
+
+    cache = get_search_cache()
+    key = make_search_key(queryset.model, queryset.get_search_terms(query), rank)
+    ids = cache.get(key)
+    if ids is None:
+        ids = _search_ids(queryset, query, rank)
+        cache.set(key, ids, get_timeout(rank))
+    return ids
+
+
+def _search_ids(queryset, query, rank=None):
+    # The index only knows the name ordering
+    ids = None
+    if rank is None:
+        ids = search_ids(location_registry.for_model(queryset.model), queryset, query)
+    if ids is None:
+        ids = queryset.search_ids(query, rank)
+    return ids
+
+
+def _search(queryset, query, rank=None):
+    # The mmap search index replaces the scan when it has been built
+    ids = None
+    if rank is None:
+        ids = search_ids(location_registry.for_model(queryset.model), queryset, query)
+    if ids is None:
+        return queryset.search(query, rank)
+    return _fetch(queryset, ids)
+
+
+def _fetch(queryset, ids):
+    locations = queryset.in_bulk(ids)
+    return [locations[pk] for pk in ids if pk in locations]
+
+
+def warm_search(queryset, query):
+    """Caches the result ids of a search, returns False if already cached."""
+    cache = get_search_cache()
+    key = make_search_key(queryset.model, queryset.get_search_terms(query))
+    if cache.get(key) is not None:
+        return False
+    cache.set(key, _search_ids(queryset, query))
+    return True
@@ -0,0 +1,223 @@
+import array
+import bisect
+import hashlib
+import mmap
+import os
+import string
+import struct
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, router
+
+from .versions import get_versions, table_key
+
+MAGIC = b'LSIX'
+FORMAT_VERSION = 2
+# magic, format version, database digest, table version, records
+HEADER = struct.Struct('=4sI8sQQ')
+CHECK_INTERVAL = 1.0  # seconds between checks for a new file or version
+# search_text__icontains on SQLite only folds the case of ASCII letters
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def get_search_index_config():
+    return {
+        'ENABLED': True,
+        'DIRECTORY': os.path.join(settings.BASE_DIR, 'search_index'),
+        **getattr(settings, 'SEARCH_INDEX', {}),
+    }
+
+
+def database_digest(model):
+    # Files built from another database (e.g. during tests) are ignored
+    database = connections[router.db_for_read(model)].settings_dict['NAME']
+    return hashlib.blake2b(str(database).encode(), digest_size=8).digest()
+
+
+def index_path(directory, location_type):
+    return os.path.join(directory, f'{location_type.key}.idx')
+
+
+def table_version(model):
+    return get_versions([model])[table_key(model)][0]
+
+
+def write_search_index(path, location_type):
+    """
+    Writes a snapshot of a location table, sorted by name, and atomically
+    replaces the file at `path`. Returns the number of records.
+
+    Layout after the header, every column native-endian and 8 byte aligned:
+    ids, text offsets (records + 1) and the search texts, ASCII letters
+    lower-cased, separated by newlines.
+    """
+    model = location_type.model
+    # Read before the rows: a write in between makes the file stale, never
+    # current with missing rows
+    version = table_version(model)
+    rows = model.objects.order_by('name', 'pk').values_list('pk', 'search_text')
+
+    ids = array.array('q')
+    offsets = array.array('q', [0])
+    texts = []
+    text_size = 0
+    for pk, search_text in rows.iterator():
+        text = search_text.translate(ASCII_LOWER).replace('\n', ' ').encode() + b'\n'
+        ids.append(pk)
+        texts.append(text)
+        text_size += len(text)
+        offsets.append(text_size)
+
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, database_digest(model), version, len(ids)
+    )
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as index_file:
+            index_file.write(header)
+            for column in (ids, offsets):
+                column.tofile(index_file)
+            index_file.writelines(texts)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return len(ids)
+
+
+class _Snapshot:
+    def __init__(self, index_file, stat):
+        self.stat_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self.mmap = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic, format_version, self.database, self.version, self.count
+        ) = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError('Not a search index file')
+
+        view = memoryview(self.mmap)
+        position = HEADER.size
+
+        def column(length):
+            nonlocal position
+            start, position = position, position + length * 8
+            return view[start:position].cast('q')
+
+        self.ids = column(self.count)
+        self.offsets = column(self.count + 1)
+        self.text_start = position
+
+    def search(self, normalized_query, limit):
+        """Ids of records whose text contains the query, in name order."""
+        needle = normalized_query.encode()
+        end = self.text_start + self.offsets[self.count]
+        ids = []
+        position = self.mmap.find(needle, self.text_start, end)
+        while position != -1 and len(ids) < limit:
+            record = bisect.bisect_right(self.offsets, position - self.text_start) - 1
+            ids.append(self.ids[record])
+            # Continue with the next record
+            position = self.mmap.find(
+                needle, self.text_start + self.offsets[record + 1], end
+            )
+        return ids
+
+
+class SearchIndex:
+    """
+    Read-only view of an index file shared by all worker processes through
+    the page cache. Mapped on first use and remapped when the file is
+    replaced by a new build. Only used while the table version it was built
+    from is current: saves and update_search_text make it stale until the
+    next build_search_index.
+    """
+
+    def __init__(self, path, model):
+        self.path = path
+        self.model = model
+        self._snapshot = None
+        self._current = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def get_snapshot(self):
+        """The mapped file, None if missing, from another database or stale."""
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < CHECK_INTERVAL:
+            return self._current
+
+        with self._lock:
+            self._checked_at = now
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self._snapshot = self._current = None
+                return None
+
+            snapshot = self._snapshot
+            stat_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if snapshot is None or snapshot.stat_key != stat_key:
+                try:
+                    with open(self.path, 'rb') as index_file:
+                        snapshot = _Snapshot(index_file, stat)
+                except (OSError, ValueError, struct.error):
+                    snapshot = None
+                if snapshot is not None and snapshot.database != database_digest(self.model):
+                    snapshot = None
+                # The old mapping is released once no search uses it anymore
+                self._snapshot = snapshot
+
+            if snapshot is not None and snapshot.version != table_version(self.model):
+                snapshot = None
+            self._current = snapshot
+            return snapshot
+
+    def search(self, normalized_query, limit=20):
+        """Ids in name order, None if there is no usable index file."""
+        snapshot = self.get_snapshot()
+        if snapshot is None:
+            return None
+        if '\n' in normalized_query:
+            return []
+        return snapshot.search(normalized_query, limit)
+
+
+_indexes = {}
+
+
+def get_search_index(location_type):
+    config = get_search_index_config()
+    if not config['ENABLED']:
+        return None
+    path = index_path(config['DIRECTORY'], location_type)
+    index = _indexes.get(location_type.key)
+    if index is None or index.path != path:
+        index = _indexes[location_type.key] = SearchIndex(path, location_type.model)
+    return index
+
+
+def search_ids(location_type, queryset, query, limit=20):
+    """
+    Same ids as queryset.search(query) on SQLite read from the index file,
+    with an indexed lookup for exact codes. None if there is no usable
+    index.
+    """
+    index = get_search_index(location_type)
+    if index is None:
+        return None
+    if not query:
+        return []
+
+    normalized_query, code = queryset.get_search_terms(query)
+    ids = index.search(normalized_query, limit + 1 if code else limit)
+    if ids is None:
+        return None
+    if code:
+        code_ids = queryset.code_match_ids(code)
+        ids = code_ids + [pk for pk in ids if pk not in code_ids]
+    return ids[:limit]
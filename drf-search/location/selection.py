@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from .registry import location_registry
+
+DEFAULTS = {
+    'COOKIE_NAME': 'selected_location',
+    'MAX_AGE': 86400,  # 24 hours
+    'SIGNED': True,
+    'SALT': 'location.selection',
+}
+
+
+def get_selection_config():
+    return {**DEFAULTS, **getattr(settings, 'LOCATION_SELECTION', {})}
+
+
+class Selection:
+    """
+    The selected location and its ancestor ids, as stored in the cookie:
+    '<key>:<id>:<parent ids>', e.g. 'airport:12:4:1' for an airport in
+    city 4 and country 1. Counting a selection needs no queries.
+    """
+
+    def __init__(self, location_type, pk, parent_ids):
+        self.location_type = location_type
+        self.pk = pk
+        self.parent_ids = parent_ids
+
+    @classmethod
+    def from_instance(cls, instance):
+        location_type = location_registry.for_model(type(instance))
+        return cls(location_type, instance.pk, location_type.ancestor_ids(instance))
+
+    @classmethod
+    def decode(cls, value):
+        """Returns None for values that do not match a registered location type."""
+        key, _, ids = value.partition(':')
+        try:
+            location_type = location_registry.get(key)
+            pk, *parent_ids = [int(id) if id else None for id in ids.split(':')]
+        except (KeyError, ValueError):
+            return None
+        if pk is None or len(parent_ids) != len(location_type.ancestors):
+            return None
+        return cls(location_type, pk, parent_ids)
+
+    def encode(self):
+        ids = [self.pk] + self.parent_ids
+        return ':'.join(
+            [self.location_type.key] + ['' if id is None else str(id) for id in ids]
+        )
+
+
+def get_selection(request):
+    config = get_selection_config()
+    if config['SIGNED']:
+        value = request.get_signed_cookie(
+            config['COOKIE_NAME'], default=None,
+            salt=config['SALT'], max_age=config['MAX_AGE']
+        )
+    else:
+        value = request.COOKIES.get(config['COOKIE_NAME'])
+    if not value:
+        return None
+    return Selection.decode(value)
+
+
+def set_selection(response, instance):
+    """Sets the selection cookie, returns the Selection."""
+    config = get_selection_config()
+    selection = Selection.from_instance(instance)
+    value = selection.encode()
+    if config['SIGNED']:
+        response.set_signed_cookie(
+            config['COOKIE_NAME'], value, salt=config['SALT'],
+            max_age=config['MAX_AGE'], httponly=True
+        )
+    else:
+        response.set_cookie(
+            config['COOKIE_NAME'], value,
+            max_age=config['MAX_AGE'], httponly=True
+        )
+    return selection
+
+
+def delete_selection(response):
+    response.delete_cookie(get_selection_config()['COOKIE_NAME'])
+
+
+class RecentSelections:
+    """
+    Small per-process LRU of (client, selection) pairs that were counted
+    recently, so repeated requests only count once per window.
+    """
+
+    def __init__(self, max_size=10000, window=300):
+        self.max_size = max_size
+        self.window = window
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def should_count(self, key, now=None):
+        """Returns True and records the key if it was not counted in the window."""
+        if not self.window:
+            return True
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            counted_at = self._seen.get(key)
+            if counted_at is not None and now - counted_at < self.window:
+                self._seen.move_to_end(key)
+                return False
+            self._seen[key] = now
+            self._seen.move_to_end(key)
+            if len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._seen.clear()
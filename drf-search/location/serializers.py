@@ -1,14 +1,32 @@
 from rest_framework import serializers
 from .models import Country, City, Airport
+from .registry import location_registry
 
 
-class CountrySerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """
+    `fields` limits the output to the given names, parents not in `expand`
+    are rendered as ids instead of nested objects.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+        if expand is not None:
+            for name, field in list(self.fields.items()):
+                if isinstance(field, serializers.BaseSerializer) and name not in expand:
+                    self.fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+
+
+class CountrySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Country
         fields = ['id', 'name', 'code', 'phone_code', 'search_count']
 
 
-class CitySerializer(serializers.ModelSerializer):
+class CitySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     country = CountrySerializer(read_only=True)
 
     class Meta:
@@ -16,7 +34,7 @@ class CitySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'country', 'search_count']
 
 
-class AirportSerializer(serializers.ModelSerializer):
+class AirportSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     country = CountrySerializer(read_only=True)
     city = CitySerializer(read_only=True)
 
@@ -25,6 +43,118 @@ class AirportSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'code', 'country', 'city', 'search_count']
 
 
+def build_location_serializer(model):
+    """
+    ModelSerializer for location models without an explicit one: own fields
+    with parents nested, in the same shape as the serializers above.
+    """
+    location_type = location_registry.for_model(model)
+    parent_names = [field.name for field in location_type.parent_fields]
+    own_fields = [
+        field.name for field in model._meta.concrete_fields
+        if not field.is_relation
+        and field.name not in ('id', 'name', 'search_text', 'search_count')
+    ]
+
+    attrs = {
+        field.name: location_serializer_for(field.related_model)(read_only=True)
+        for field in location_type.parent_fields
+    }
+    attrs['Meta'] = type('Meta', (), {
+        'model': model,
+        'fields': ['id', 'name'] + own_fields + parent_names + ['search_count'],
+    })
+    return type(
+        f'{model.__name__}Serializer',
+        (SparseFieldsMixin, serializers.ModelSerializer),
+        attrs
+    )
+
+
+def location_serializer_for(model):
+    if model not in LOCATION_SERIALIZERS:
+        LOCATION_SERIALIZERS[model] = build_location_serializer(model)
+    return LOCATION_SERIALIZERS[model]
+
+
+LOCATION_SERIALIZERS = {
+    Country: CountrySerializer,
+    City: CitySerializer,
+    Airport: AirportSerializer,
+}
+
+
+def normalize_code(code):
+    return code.strip().upper()
+
+
+class LocationResolveSerializer(serializers.Serializer):
+    """
+    Ids and codes to resolve. Results list the ids in the given order,
+    then the codes in the given order; the two lists are not interleaved.
+    The `code_field` context entry is the model's code field, if any.
+    Codes are looked up upper-cased in `code_keys`, `codes` stays as given.
+    """
+    MAX_ITEMS = 500
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, default=list
+    )
+    codes = serializers.ListField(
+        child=serializers.CharField(trim_whitespace=False), required=False,
+        default=list
+    )
+
+    def validate_codes(self, codes):
+        field = self.context.get('code_field')
+        if not codes:
+            return codes
+        if field is None:
+            raise serializers.ValidationError('This location type has no codes.')
+        too_long = [
+            code for code in codes if len(normalize_code(code)) > field.max_length
+        ]
+        if too_long:
+            raise serializers.ValidationError(
+                f"Codes are at most {field.max_length} characters: "
+                f"{', '.join(too_long)}"
+            )
+        return codes
+
+    def validate(self, attrs):
+        total = len(attrs['ids']) + len(attrs['codes'])
+        if not total:
+            raise serializers.ValidationError('Provide ids or codes.')
+        if total > self.MAX_ITEMS:
+            raise serializers.ValidationError(
+                f'At most {self.MAX_ITEMS} ids and codes can be resolved at once.'
+            )
+        attrs['code_keys'] = [normalize_code(code) for code in attrs['codes']]
+        return attrs
+
+
+class SearchCountEntrySerializer(serializers.Serializer):
+    model = serializers.CharField()
+    id = serializers.IntegerField()
+    delta = serializers.IntegerField(min_value=1, max_value=10000)
+
+    def validate_model(self, model):
+        if model not in location_registry.keys():
+            raise serializers.ValidationError(
+                f"Unknown model. Choose from: {', '.join(location_registry.keys())}"
+            )
+        return location_registry.get(model)
+
+
+class SearchCountsSerializer(serializers.Serializer):
+    MAX_ITEMS = 1000
+
+    counts = serializers.ListField(
+        child=SearchCountEntrySerializer(), allow_empty=False,
+        max_length=MAX_ITEMS
+    )
+
+
 class CountrySearchRatioSerializer(serializers.ModelSerializer):
     search_ratio = serializers.FloatField()
     total_city_searches = serializers.IntegerField()
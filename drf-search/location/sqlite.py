@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.db import connections
+
+SQLITE_PROFILES = {
+    # SQLite defaults: rollback journal, fsync on every commit
+    'default': {},
+    # WAL lets readers run while the counter middleware and the API log write,
+    # synchronous=NORMAL only fsyncs on checkpoints instead of every commit
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,  # KiB
+        'busy_timeout': 5000,  # ms
+        'temp_store': 'MEMORY',
+    },
+}
+
+
+def get_sqlite_pragmas(profile):
+    try:
+        return SQLITE_PROFILES[profile]
+    except KeyError:
+        raise ValueError(
+            f"Unknown SQLite profile '{profile}', "
+            f"choose one of: {', '.join(SQLITE_PROFILES)}"
+        )
+
+
+def apply_sqlite_pragmas(cursor, pragmas):
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def sqlite_init_command(pragmas):
+    return '; '.join(f'PRAGMA {name} = {value}' for name, value in pragmas.items())
+
+
+def configure_sqlite_database(settings_dict):
+    """
+    Adds the SQLITE_PROFILE pragmas to OPTIONS['init_command'], which Django
+    runs on the raw connection: new connections (one per request with
+    CONN_MAX_AGE=0) add no queries to the request profile.
+    """
+    if settings_dict['ENGINE'] != 'django.db.backends.sqlite3':
+        return
+
+    profile = settings_dict.get(
+        'SQLITE_PROFILE', getattr(settings, 'SQLITE_PROFILE', 'default')
+    )
+    options = settings_dict.setdefault('OPTIONS', {})
+    commands = [
+        command
+        for command in (
+            sqlite_init_command(get_sqlite_pragmas(profile)),
+            options.get('init_command', ''),
+        )
+        if command
+    ]
+    if commands:
+        options['init_command'] = '; '.join(commands)
+
+
+def configure_sqlite_databases():
+    for alias in connections:
+        configure_sqlite_database(connections.settings[alias])
@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class LocationTestRunner(DiscoverRunner):
+    """
+    Points the metrics files, file based caches and the search index at a
+    temporary directory for the whole run, so tests never write into
+    BASE_DIR. The search cache is disabled unless a test enables one.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.temp_directory = tempfile.mkdtemp(prefix='location_tests_')
+        caches = {alias: dict(config) for alias, config in settings.CACHES.items()}
+        for alias, config in caches.items():
+            if config['BACKEND'].endswith('FileBasedCache'):
+                config['LOCATION'] = os.path.join(self.temp_directory, 'cache', alias)
+        # Test transactions never commit, so search cache generations are
+        # never bumped: tests that need the cache enable a fresh one
+        search_alias = getattr(settings, 'SEARCH_CACHE', {}).get('ALIAS', 'search')
+        caches[search_alias] = {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        }
+        self.settings_override = override_settings(
+            CACHES=caches,
+            LATENCY_METRICS={
+                **getattr(settings, 'LATENCY_METRICS', {}),
+                'DIRECTORY': os.path.join(self.temp_directory, 'metrics'),
+            },
+            SEARCH_INDEX={
+                **getattr(settings, 'SEARCH_INDEX', {}),
+                'DIRECTORY': os.path.join(self.temp_directory, 'search_index'),
+            },
+        )
+        self.settings_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.settings_override.disable()
+        shutil.rmtree(self.temp_directory, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
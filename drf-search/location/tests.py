@@ -1,10 +1,43 @@
-from django.test import TestCase, Client
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, Client, override_settings
+from django.db import connection, models, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test.utils import CaptureQueriesContext, isolate_apps
 from django.urls import reverse
 from rest_framework import status
-from rest_framework.test import APITestCase
-from .models import Country, City, Airport
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+from .models import (
+    Country, City, Airport, APILog, BaseLocationModel, LocationSearchBucket
+)
+from .profiling import QueryBudgetExceeded, RequestProfile
+from .registry import LocationRegistry, location_registry
+from .routers import LocationRouter
+from .search_index import SearchIndex, get_search_index, index_path
+from .selection import RecentSelections
+from .search_cache import get_generation, get_search_cache, invalidate_search_cache
+from .singleflight import SingleFlight
+from .trending import current_hour, rollup_buckets
+from .versions import get_versions
 from io import StringIO
 from django.core.management import call_command
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+import os
+import shutil
+import tempfile
+import sqlite3
+import threading
+import time
+from unittest import mock
+from . import catalogue as catalogue_module
+from .catalogue import get_catalogue, reset_catalogue
+from .managers import LocationQuerySet
+from .metrics import MmapedDict, read_values
+from .sqlite import apply_sqlite_pragmas, configure_sqlite_database, get_sqlite_pragmas
+from .serializers import AirportSerializer, CitySerializer, CountrySerializer
+from .views import CountryViewSet, location_viewset_for
 
 
 class LocationModelsTest(TestCase):
@@ -49,8 +82,20 @@ class LocationModelsTest(TestCase):
         self.country.increment_search_count()
         self.assertEqual(self.country.search_count, initial_count + 1)
 
+        # Parents are counted too, without a new table version
+        versions = get_versions([Airport])
+        self.airport.increment_search_count()
+        self.assertEqual(self.airport.search_count, 1)
+        self.city.refresh_from_db()
+        self.country.refresh_from_db()
+        self.assertEqual(self.city.search_count, 1)
+        self.assertEqual(self.country.search_count, initial_count + 2)
+        self.assertEqual(get_versions([Airport]), versions)
+
 
 class LocationAPITest(APITestCase):
+    databases = {'default', 'logs'}
+
     def setUp(self):
         self.client = Client()
         
@@ -93,22 +138,162 @@ class LocationAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 1)
 
+    def test_search_by_code(self):
+        """Exact codes are matched and listed first"""
+        Airport.objects.create(
+            name="Atstone Airport",
+            code="ATS",
+            country=self.country,
+            city=self.city,
+            search_text="Atstone Airport,Test City,Test Country"
+        )
+        response = self.client.get(reverse('airports-search'), {'q': 'tst'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [airport['code'] for airport in response.data], ['TST', 'ATS']
+        )
+
+        response = self.client.get(reverse('countries-search'), {'q': 'TC'})
+        self.assertEqual(response.data[0]['code'], 'TC')
+
+        # Cities have no code
+        response = self.client.get(reverse('cities-search'), {'q': 'TC'})
+        self.assertEqual(len(response.data), 0)
+
+        # The code is an index lookup of its own, the scan fills the rest
+        with CaptureQueriesContext(connection) as queries:
+            results = Airport.objects.search('tst')
+        self.assertEqual([airport.code for airport in results], ['TST', 'ATS'])
+        self.assertNotIn('LIKE', queries[0]['sql'])
+        self.assertNotIn('CASE', queries[1]['sql'])
+
+        # No scan once the code match fills the results
+        with mock.patch.object(LocationQuerySet, 'search_limit', 1):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(Airport.objects.search_ids('tst'), [self.airport.pk])
+        self.assertEqual(len(queries), 1)
+
+    def test_resolve(self):
+        """Resolve many locations in one query, keeping the input order"""
+        other = Airport.objects.create(
+            name="Other Airport",
+            code="OTH",
+            country=self.country,
+            city=self.city,
+            search_text="Other Airport,Test City,Test Country"
+        )
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                reverse('airports-resolve'),
+                {'ids': [other.id, 999, self.airport.id], 'codes': ['tst', ' zzz ', 'XXX']},
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [airport['code'] for airport in response.data['results']],
+            ['OTH', 'TST', 'TST']
+        )
+        self.assertEqual(
+            # Missing codes as given, not normalized
+            response.data['missing'], {'ids': [999], 'codes': [' zzz ', 'XXX']}
+        )
+        self.assertEqual(
+            response.data['results'][0]['city']['country']['code'], 'TC'
+        )
+
+    def test_resolve_invalid(self):
+        """Codes on models without them, empty and oversized requests fail"""
+        response = self.client.post(
+            reverse('cities-resolve'), {'codes': ['TST']},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(
+            reverse('airports-resolve'), {},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(
+            reverse('airports-resolve'), {'ids': list(range(501))},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Longer than Airport.code
+        response = self.client.post(
+            reverse('airports-resolve'), {'codes': ['TSTX']},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('at most 3 characters', str(response.data['codes']))
+
+    def test_sparse_fields(self):
+        """?fields= trims the output and the query"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('airports-search'), {'q': 'Test', 'fields': 'id,name,code'}
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data,
+            [{'id': self.airport.id, 'name': 'Test Airport', 'code': 'TST'}]
+        )
+        sql = queries[0]['sql']
+        self.assertNotIn('JOIN', sql)
+        self.assertNotIn('search_count', sql)
+
+    def test_expand(self):
+        """Parents are ids unless expanded"""
+        response = self.client.get(
+            reverse('airports-detail', args=[self.airport.id]), {'expand': 'city'}
+        )
+        self.assertEqual(response.data['country'], self.country.id)
+        self.assertEqual(response.data['city']['name'], 'Test City')
+        self.assertEqual(response.data['city']['country']['code'], 'TC')
+
+        response = self.client.get(
+            reverse('airports-list'), {'fields': 'id,city', 'expand': 'country'}
+        )
+        self.assertEqual(set(response.data[0]), {'id', 'city'})
+        self.assertIsInstance(response.data[0]['city'], int)
+
+        response = self.client.get(reverse('airports-list'), {'fields': 'id,foo'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_pagination(self):
+        """A configured pagination class is used by list"""
+        class Pagination(PageNumberPagination):
+            page_size = 2
+
+        with mock.patch.multiple(
+            CountryViewSet,
+            pagination_class=Pagination,
+            queryset=Country.objects.order_by('pk'),
+        ):
+            response = self.client.get(reverse('countries-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], Country.objects.count())
+        self.assertEqual(len(response.data['results']), 2)
+
     def test_select_endpoints(self):
         """Test select functionality for all models"""
         # Test country selection
         response = self.client.post(reverse('countries-select', args=[self.country.id]))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertTrue('selected_countries' in response.cookies)
+        self.assertTrue('selected_location' in response.cookies)
 
         # Test city selection
         response = self.client.post(reverse('cities-select', args=[self.city.id]))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertTrue('selected_cities' in response.cookies)
+        self.assertTrue('selected_location' in response.cookies)
 
-        # Test airport selection
+        # Test airport selection replaces the city
         response = self.client.post(reverse('airports-select', args=[self.airport.id]))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertTrue('selected_airports' in response.cookies)
+        self.assertEqual(len(response.cookies), 1)
+        self.assertTrue('selected_location' in response.cookies)
 
     def test_deselect_endpoints(self):
         """Test deselect functionality for all models"""
@@ -116,7 +301,7 @@ class LocationAPITest(APITestCase):
         self.client.post(reverse('countries-select', args=[self.country.id]))
         response = self.client.post(reverse('countries-deselect'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.cookies['selected_countries'].value, '')
+        self.assertEqual(response.cookies['selected_location'].value, '')
 
     def test_most_searched_cities(self):
         """Test most searched cities endpoint"""
@@ -169,7 +354,99 @@ class LocationAPITest(APITestCase):
         self.assertEqual(len(response.data), 2)
 
 
+class ConditionalResponseTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        self.client = Client()
+        self.country = Country.objects.create(
+            name="Test Country",
+            code="TC",
+            phone_code="+99",
+            search_text="Test Country"
+        )
+
+    def test_not_modified(self):
+        """A matching If-None-Match gets a 304 after one query"""
+        response = self.client.get(reverse('countries-list'))
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('Last-Modified', response)
+
+        # Only the version lookup runs
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                reverse('countries-list'), HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        # Other query strings have their own ETag
+        response = self.client.get(
+            reverse('countries-list'), {'fields': 'id'}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_etag_changes_on_write(self):
+        """Saves change the ETag, search counts only once per window"""
+        url = reverse('countries-search-ratio')
+        with mock.patch('location.versions.time') as clock:
+            clock.time.return_value = 6000.0
+            response = self.client.get(url, {'country_code': 'TC'})
+            etag = response['ETag']
+
+            # Counter updates leave the versions alone
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(reverse('countries-select', args=[self.country.id]))
+            self.assertFalse(any(
+                'location_locationtableversion' in query['sql'] for query in queries
+            ))
+            response = self.client.get(
+                url, {'country_code': 'TC'}, HTTP_IF_NONE_MATCH=etag
+            )
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+            # The next count window does
+            clock.time.return_value = 6060.0
+            response = self.client.get(
+                url, {'country_code': 'TC'}, HTTP_IF_NONE_MATCH=etag
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data[0]['total_city_searches'], 0)
+            etag = response['ETag']
+
+            # Saves of a nested or aggregated model too
+            City.objects.create(name="Test City", country=self.country)
+            response = self.client.get(
+                url, {'country_code': 'TC'}, HTTP_IF_NONE_MATCH=etag
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_if_modified_since_ignored(self):
+        """Last-Modified has one second resolution, only ETags give 304s"""
+        response = self.client.get(reverse('countries-list'))
+        response = self.client.get(
+            reverse('countries-list'),
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+    def test_wildcard_not_answered(self):
+        """If-None-Match: * never hides a missing location behind a 304"""
+        response = self.client.get(
+            reverse('countries-detail', args=[999999]), HTTP_IF_NONE_MATCH='*'
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(
+            reverse('countries-detail', args=[self.country.id]), HTTP_IF_NONE_MATCH='*'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
 class LocationMiddlewareTest(TestCase):
+    databases = {'default', 'logs'}
+
     def setUp(self):
         self.client = Client()
         self.country = Country.objects.create(
@@ -179,18 +456,92 @@ class LocationMiddlewareTest(TestCase):
             search_text="Test Country"
         )
 
+    def client_without_window(self):
+        """A new client, its middleware reads the current SEARCH_COUNTING"""
+        client = Client()
+        client.cookies = self.client.cookies
+        return client
+
     def test_search_count_middleware(self):
         """Test if search count increases when location is selected"""
         initial_count = self.country.search_count
         
-        # Select country and make a request
+        # Select country and make requests
         self.client.post(reverse('countries-select', args=[self.country.id]))
-        self.client.get(reverse('countries-list'))
-        
-        # Refresh from database
+        for _ in range(5):
+            self.client.get(reverse('countries-list'))
+
+        # Counted once by select, the requests are in its window
         self.country.refresh_from_db()
         self.assertEqual(self.country.search_count, initial_count + 1)
 
+    def test_not_modified_counted(self):
+        """A 304 counts the selection like the 200 it replaces"""
+        response = self.client.get(reverse('countries-list'))
+        self.client.post(reverse('countries-select', args=[self.country.id]))
+        with self.settings(SEARCH_COUNTING={**settings.SEARCH_COUNTING, 'DEDUP_WINDOW': 0}):
+            response = self.client_without_window().get(
+                reverse('countries-list'), HTTP_IF_NONE_MATCH=response['ETag']
+            )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.country.refresh_from_db()
+        self.assertEqual(self.country.search_count, 2)
+
+    def test_selection_counted_without_reads(self):
+        """The cookie's parent ids are counted with UPDATEs only"""
+        city = City.objects.create(name="Test City", country=self.country)
+        self.client.post(reverse('cities-select', args=[city.id]))
+
+        with self.settings(SEARCH_COUNTING={**settings.SEARCH_COUNTING, 'DEDUP_WINDOW': 0}):
+            with CaptureQueriesContext(connection) as queries:
+                self.client_without_window().get(reverse('countries-list'))
+        updates = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('UPDATE')
+        ]
+        # City and country, the table versions are left alone
+        self.assertEqual(len(updates), 2)
+
+        city.refresh_from_db()
+        self.country.refresh_from_db()
+        self.assertEqual(city.search_count, 2)
+        self.assertEqual(self.country.search_count, 2)
+
+    def test_tampered_selection_ignored(self):
+        self.client.cookies['selected_location'] = f'country:{self.country.id}'
+        self.client.get(reverse('countries-list'))
+
+        self.country.refresh_from_db()
+        self.assertEqual(self.country.search_count, 0)
+
+    def test_selection_counted_once_per_window(self):
+        self.client.post(reverse('countries-select', args=[self.country.id]))
+        self.client.get(reverse('countries-list'))
+        self.client.get(reverse('countries-list'))
+
+        self.country.refresh_from_db()
+        self.assertEqual(self.country.search_count, 1)
+
+    def test_excluded_paths_not_counted(self):
+        self.client.post(reverse('countries-select', args=[self.country.id]))
+        self.client.post(reverse('countries-select', args=[self.country.id]))
+        self.client.get('/swagger/?format=openapi')
+
+        # Only the select calls themselves
+        self.country.refresh_from_db()
+        self.assertEqual(self.country.search_count, 2)
+
+    def test_recent_selections(self):
+        recent = RecentSelections(max_size=2, window=60)
+        self.assertTrue(recent.should_count('a', now=0))
+        self.assertFalse(recent.should_count('a', now=30))
+        self.assertTrue(recent.should_count('a', now=61))
+
+        # Least recently used key is evicted
+        recent.should_count('b', now=62)
+        recent.should_count('c', now=63)
+        self.assertTrue(recent.should_count('a', now=64))
+
     def test_search_count_on_error(self):
         """Test that search count doesn't increase on error responses"""
         initial_count = self.country.search_count
@@ -202,6 +553,790 @@ class LocationMiddlewareTest(TestCase):
         self.assertEqual(self.country.search_count, initial_count)
 
 
+class QueryProfilingMiddlewareTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        self.client = Client()
+        self.country = Country.objects.create(
+            name="Test Country",
+            code="TC",
+            phone_code="+99",
+            search_text="Test Country"
+        )
+
+    @override_settings(QUERY_PROFILING={'SERVER_TIMING': True})
+    def test_server_timing_header(self):
+        """Test that query and timing metrics are emitted as headers"""
+        response = self.client.get(reverse('countries-search'), {'q': 'Test'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        # Table versions for the ETag and the search itself
+        self.assertIn('2 queries', response['Server-Timing'])
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+        self.assertIn('render;dur=', response['Server-Timing'])
+
+    @override_settings(QUERY_PROFILING={'SERVER_TIMING': False})
+    def test_server_timing_disabled(self):
+        """Without SERVER_TIMING the numbers stay out of the response"""
+        response = self.client.get(reverse('countries-list'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(APILog.objects.get().query_count, 2)
+
+    def test_profile_stored_in_api_log(self):
+        """Test that the profile is stored with the API log"""
+        self.client.get(reverse('countries-list'))
+        log = APILog.objects.get()
+        self.assertEqual(log.query_count, 2)
+        self.assertIsNotNone(log.db_time)
+        self.assertIsNotNone(log.serializer_time)
+        self.assertIsNotNone(log.render_time)
+
+    def test_query_budget_exceeded(self):
+        """Test that strict mode fails requests over their query budget"""
+        config = {'STRICT': True, 'BUDGETS': {'countries-list': 0}}
+        with override_settings(QUERY_PROFILING=config):
+            with self.assertRaises(QueryBudgetExceeded):
+                Client().get(reverse('countries-list'))
+
+    def test_query_budget_respected(self):
+        """Test that requests within their budget pass in strict mode"""
+        config = {'STRICT': True, 'BUDGETS': {'countries-list': 2}}
+        with override_settings(QUERY_PROFILING=config):
+            response = Client().get(reverse('countries-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class LatencyMetricsTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        self.client = Client()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.settings_override = override_settings(LATENCY_METRICS={
+            'DIRECTORY': self.directory,
+            'BUCKETS': [0.1, 1.0],
+        })
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_values_aggregated_across_files(self):
+        """Test that values written by different workers are summed"""
+        for name in ('latency_1.db', 'latency_2.db'):
+            store = MmapedDict(os.path.join(self.directory, name))
+            store.inc('requests', 2)
+            store.close()
+
+        # Reopening a file keeps its existing values
+        store = MmapedDict(os.path.join(self.directory, 'latency_1.db'))
+        store.inc('requests', 1)
+        store.close()
+
+        self.assertEqual(read_values(self.directory), {'requests': 5.0})
+
+    def test_metrics_endpoint(self):
+        """Test that API requests show up in the histogram"""
+        self.client.get(reverse('countries-list'))
+        self.client.get(reverse('countries-list'))
+        self.client.get('/api/non-existent/')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = response.content.decode()
+        self.assertIn('# TYPE api_request_duration_seconds histogram', content)
+        self.assertIn(
+            'api_request_duration_seconds_bucket'
+            '{route="countries-list",status="2xx",le="+Inf"} 2',
+            content
+        )
+        self.assertIn(
+            'api_request_duration_seconds_count'
+            '{route="unmatched",status="4xx"} 1',
+            content
+        )
+
+    def test_metrics_allowed_ips(self):
+        """Test that /metrics is hidden from other clients"""
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # A forwarded address does not help
+        response = self.client.get(
+            '/metrics', REMOTE_ADDR='10.0.0.5', HTTP_X_FORWARDED_FOR='127.0.0.1'
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        with self.settings(LATENCY_METRICS={
+            'DIRECTORY': self.directory, 'ALLOWED_IPS': ['10.0.0.5']
+        }):
+            response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_search_counter(self):
+        """Test that searches are counted by outcome"""
+        self.client.get(reverse('countries-search'), {'q': 'Test'})
+
+        response = self.client.get('/metrics')
+        self.assertIn(
+            'location_search_total{model="country",outcome="executed"} 1.0',
+            response.content.decode()
+        )
+
+
+class SingleFlightTest(SimpleTestCase):
+    def test_concurrent_calls_coalesced(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def search():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return ['Istanbul']
+
+        results = []
+
+        def request():
+            results.append(flight.do(('city', 'ist'), search))
+
+        leader = threading.Thread(target=request)
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=request) for _ in range(3)]
+        for follower in followers:
+            follower.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False, True, True, True])
+        self.assertTrue(all(result == ['Istanbul'] for result, _ in results))
+        self.assertEqual(flight.in_flight(), 0)
+
+        # Finished calls are not cached
+        self.assertEqual(flight.do(('city', 'ist'), lambda: []), ([], False))
+
+    def test_errors_shared(self):
+        flight = SingleFlight()
+
+        def fail():
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            flight.do('key', fail)
+        self.assertEqual(flight.in_flight(), 0)
+
+
+class SQLiteProfileTest(TestCase):
+    def test_production_profile(self):
+        """Test that the production profile pragmas are applied"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        db = sqlite3.connect(os.path.join(directory, 'test.sqlite3'))
+        self.addCleanup(db.close)
+
+        apply_sqlite_pragmas(db.cursor(), get_sqlite_pragmas('production'))
+
+        self.assertEqual(db.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(db.execute('PRAGMA synchronous').fetchone()[0], 1)
+        self.assertEqual(db.execute('PRAGMA temp_store').fetchone()[0], 2)
+        self.assertEqual(db.execute('PRAGMA busy_timeout').fetchone()[0], 5000)
+
+    def test_django_connection(self):
+        """Test that new Django connections get the pragmas without queries"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_dict = {
+            **connection.settings_dict,
+            'NAME': os.path.join(directory, 'test.sqlite3'),
+            'SQLITE_PROFILE': 'production',
+            'OPTIONS': {'init_command': 'PRAGMA cache_spill = OFF'},
+        }
+        configure_sqlite_database(settings_dict)
+        db = DatabaseWrapper(settings_dict, alias='sqlite_profile_test')
+        self.addCleanup(db.close)
+
+        profile = RequestProfile()
+        with db.execute_wrapper(profile):
+            db.ensure_connection()
+        self.assertEqual(profile.query_count, 0)
+
+        with db.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -64 * 1024)
+            # Existing init commands are kept
+            cursor.execute('PRAGMA cache_spill')
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_unknown_profile(self):
+        """Test that an unknown profile name is rejected"""
+        with self.assertRaises(ValueError):
+            get_sqlite_pragmas('unknown')
+
+
+class LocationRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = LocationRouter()
+
+    def test_reads_and_writes(self):
+        """Test that reads use the read alias and writes the primary"""
+        self.assertEqual(self.router.db_for_read(City), 'replica')
+        self.assertEqual(self.router.db_for_write(City), 'default')
+        self.assertEqual(self.router.db_for_read(APILog), 'logs')
+        self.assertEqual(self.router.db_for_write(APILog), 'logs')
+
+    def test_migrations(self):
+        """Test that each database only gets its own tables"""
+        self.assertTrue(self.router.allow_migrate('logs', 'location', 'apilog'))
+        self.assertFalse(self.router.allow_migrate('default', 'location', 'apilog'))
+        self.assertFalse(self.router.allow_migrate('logs', 'location', 'city'))
+        self.assertFalse(self.router.allow_migrate('logs', 'auth', 'user'))
+        self.assertFalse(self.router.allow_migrate('replica', 'location', 'city'))
+        self.assertIsNone(self.router.allow_migrate('default', 'location', 'city'))
+
+
+class LocationRouterTransactionTest(TestCase):
+    def test_reads_inside_transaction(self):
+        """Test that reads inside a primary transaction see its writes"""
+        # TestCase wraps every test in a transaction on the primary
+        self.assertEqual(LocationRouter().db_for_read(City), 'default')
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'search': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'search-cache-test',
+    },
+})
+class SearchCacheTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        self.client = Client()
+        get_search_cache().clear()
+        self.country = Country.objects.create(
+            name="Test Country",
+            code="TC",
+            phone_code="+99",
+            search_text="Test Country"
+        )
+        for query in ['test', 'Test', 'test', 'other']:
+            APILog.objects.create(
+                path='/api/countries/search/', method='GET', status_code=200,
+                response_time=1, request_data={'q': query}
+            )
+
+    def test_cached_ids_with_fresh_rows(self):
+        """Cached ids, rows read fresh, saves invalidate"""
+        self.client.get(reverse('countries-search'), {'q': 'test'})
+        Country.objects.filter(pk=self.country.pk).update(search_count=5)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('countries-search'), {'q': 'Test'})
+        self.assertNotIn('LIKE', queries[-1]['sql'])
+        self.assertEqual(response.data[0]['search_count'], 5)
+
+        # Saves invalidate the cached ids once committed
+        with self.captureOnCommitCallbacks(execute=True):
+            Country.objects.create(
+                name="Test Other", code="TO", phone_code="+98", search_text="Test Other"
+            )
+        response = self.client.get(reverse('countries-search'), {'q': 'test'})
+        self.assertEqual(len(response.data), 2)
+
+    def test_generation_after_commit(self):
+        """Invalidation waits for the commit and uses the same key everywhere"""
+        generation = get_generation(Country)
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                # The read alias changes inside transactions, the key must not
+                self.assertEqual(get_generation(Country), generation)
+                invalidate_search_cache(Country)
+                self.assertEqual(get_generation(Country), generation)
+        self.assertEqual(get_generation(Country), generation)
+
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(get_generation(Country), generation)
+
+    def test_ranked_results_expire(self):
+        """Trending results are cached for RANKED_TIMEOUT, name order without"""
+        cache = get_search_cache()
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            self.client.get(reverse('countries-search'), {'q': 'test', 'rank': 'trending'})
+            self.client.get(reverse('countries-search'), {'q': 'test'})
+        self.assertEqual(
+            [call.args[2] for call in cache_set.call_args_list if len(call.args) > 2],
+            [60, DEFAULT_TIMEOUT]
+        )
+
+    def test_warm_search_cache(self):
+        """Frequent logged queries are cached once"""
+        out = StringIO()
+        call_command('warm_search_cache', '--limit', '1', stdout=out)
+        self.assertIn('Found 1 frequent search queries', out.getvalue())
+        self.assertIn('Warmed 1 searches', out.getvalue())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('countries-search'), {'q': 'TEST'})
+        self.assertFalse(any('LIKE' in query['sql'] for query in queries))
+
+        out = StringIO()
+        call_command('warm_search_cache', stdout=out)
+        self.assertIn('Warmed 1 searches (1 already cached)', out.getvalue())
+
+
+class SearchIndexTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        self.client = Client()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.settings_override = override_settings(
+            SEARCH_INDEX={'ENABLED': True, 'DIRECTORY': self.directory},
+            SEARCH_CACHE={'ENABLED': False},
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        self.country = Country.objects.create(
+            name="Test Country", code="TC", phone_code="+99",
+            search_text="Test Country"
+        )
+        self.city = City.objects.create(
+            name="Test City", country=self.country,
+            search_text="Test City,Test Country"
+        )
+        self.airport = Airport.objects.create(
+            name="Test Airport", code="TST", city=self.city,
+            country=self.country, search_text="Test Airport,Test City,Test Country"
+        )
+        self.other = Airport.objects.create(
+            name="Atstone Airport", code="ATS", city=self.city,
+            country=self.country, search_text="Atstone Airport,Test City,Test Country"
+        )
+        call_command('build_search_index', stdout=StringIO())
+
+    def search(self, model, query):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f'{model}-search'), {'q': query})
+        self.assertFalse(any('LIKE' in query['sql'] for query in queries))
+        return [location['id'] for location in response.data]
+
+    def test_same_results_as_database(self):
+        """The index returns the ids of the LIKE search without running it."""
+        for model, basename, query in [
+            (Airport, 'airports', 'test'),
+            (Airport, 'airports', 'TST'),
+            (City, 'cities', 'TEST COUNTRY'),
+            (Country, 'countries', 'xyz'),
+        ]:
+            expected = [location.id for location in model.objects.search(query)]
+            self.assertEqual(self.search(basename, query), expected)
+
+    def test_non_ascii_queries_match_database(self):
+        """Only ASCII letters are case folded, as by LIKE on SQLite."""
+        City.objects.create(
+            name="Zürich", country=self.country, search_text="Zürich,Test Country"
+        )
+        City.objects.create(
+            name="İzmir", country=self.country, search_text="İzmir,Test Country"
+        )
+        call_command('build_search_index', '--model', 'city', stdout=StringIO())
+
+        for query in ['Zürich', 'zurich', 'ZÜR', 'İzmir', 'izmir', 'rich,TEST']:
+            expected = [location.id for location in City.objects.search(query)]
+            self.assertEqual(self.search('cities', query), expected)
+
+    def test_stale_index_falls_back_to_database(self):
+        """Saves after a build are searched in the database until the next."""
+        Country.objects.create(
+            name="New Country", code="NC", phone_code="+97",
+            search_text="New Country"
+        )
+        with mock.patch('location.search_index.CHECK_INTERVAL', 0):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(
+                    reverse('countries-search'), {'q': 'new country'}
+                )
+            self.assertTrue(any('LIKE' in query['sql'] for query in queries))
+            self.assertEqual(len(response.data), 1)
+
+            call_command('build_search_index', '--model', 'country', stdout=StringIO())
+            self.assertEqual(len(self.search('countries', 'new country')), 1)
+
+    def test_new_file_swapped_in(self):
+        """A rebuilt file is mapped in place of the old one."""
+        location_type = location_registry.for_model(Country)
+        index = get_search_index(location_type)
+        old_snapshot = index.get_snapshot()
+        Country.objects.create(
+            name="New Country", code="NC", phone_code="+97",
+            search_text="New Country"
+        )
+        call_command('build_search_index', '--model', 'country', stdout=StringIO())
+
+        with mock.patch('location.search_index.CHECK_INTERVAL', 0):
+            snapshot = index.get_snapshot()
+        self.assertIsNot(snapshot, old_snapshot)
+        self.assertEqual(snapshot.count, Country.objects.count())
+
+    def test_other_database_ignored(self):
+        """A file built from another database is not used."""
+        location_type = location_registry.for_model(Country)
+        with mock.patch(
+            'location.search_index.database_digest', return_value=b'x' * 8
+        ):
+            index = SearchIndex(
+                index_path(self.directory, location_type), Country
+            )
+            self.assertIsNone(index.search('test'))
+
+
+class LocationCatalogueTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        self.client = Client()
+        self.settings_override = override_settings(
+            LOCATION_CATALOGUE={'ENABLED': True, 'REFRESH_INTERVAL': 0}
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        reset_catalogue()
+        self.addCleanup(reset_catalogue)
+
+        self.country = Country.objects.create(
+            name="Test Country", code="TC", phone_code="+99",
+            search_text="Test Country"
+        )
+        self.city = City.objects.create(
+            name="Test City", country=self.country,
+            search_text="Test City,Test Country"
+        )
+        self.airport = Airport.objects.create(
+            name="Test Airport", code="TST", city=self.city,
+            country=self.country, search_text="Test Airport,Test City,Test Country"
+        )
+
+    def test_same_output_as_serializers(self):
+        catalogue = get_catalogue()
+        for instance, serializer in [
+            (self.country, CountrySerializer),
+            (self.city, CitySerializer),
+            (self.airport, AirportSerializer),
+        ]:
+            self.assertEqual(
+                catalogue.serialize_ids(type(instance), [instance.id]),
+                [serializer(instance).data]
+            )
+        self.assertEqual(
+            catalogue.serialize_ids(Airport, [self.airport.id], {'id', 'city'}, set()),
+            [{'id': self.airport.id, 'city': self.city.id}]
+        )
+
+    def test_search_and_resolve(self):
+        response = self.client.get(reverse('airports-search'), {'q': 'test'})
+        self.assertEqual(response.data, [AirportSerializer(self.airport).data])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('airports-resolve'),
+                {'ids': [self.airport.id, 999], 'codes': ['TST', 'zzz']},
+                content_type='application/json'
+            )
+        self.assertFalse(any('location_airport' in query['sql'] for query in queries))
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(response.data['missing'], {'ids': [999], 'codes': ['zzz']})
+
+    def test_reloaded_on_change(self):
+        """Saves reload the catalogue, counted selections do not"""
+        catalogue = get_catalogue()
+        self.assertIs(get_catalogue(), catalogue)
+
+        self.client.post(reverse('airports-select', args=[self.airport.id]))
+        self.assertIs(get_catalogue(), catalogue)
+
+        Country.objects.create(
+            name="New Country", code="NC", phone_code="+97", search_text="New Country"
+        )
+        with self.settings(LOCATION_CATALOGUE={
+            'ENABLED': True, 'REFRESH_INTERVAL': 0, 'BACKGROUND_RELOAD': False
+        }):
+            self.assertIsNot(get_catalogue(), catalogue)
+            self.assertEqual(
+                len(get_catalogue().table(Country)), Country.objects.count()
+            )
+
+    def test_counts_refreshed_per_window(self):
+        """Search counts are read again after COUNT_WINDOW, in place"""
+        catalogue = get_catalogue()
+        for _ in range(3):
+            self.client.post(reverse('airports-select', args=[self.airport.id]))
+        table = catalogue.table(Airport)
+        row = table.row_for_id(self.airport.id)
+        self.assertEqual(get_catalogue().table(Airport).columns['search_count'][row], 0)
+
+        catalogue.counts_at -= 60
+        with self.settings(LOCATION_CATALOGUE={
+            'ENABLED': True, 'REFRESH_INTERVAL': 0, 'BACKGROUND_RELOAD': False
+        }):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertIs(get_catalogue(), catalogue)
+        # Versions and one query per table
+        self.assertEqual(len(queries), 1 + len(catalogue.tables))
+        self.assertEqual(table.columns['search_count'][row], 3)
+        self.assertEqual(
+            catalogue.table(Country).columns['search_count'][
+                catalogue.table(Country).row_for_id(self.country.id)
+            ],
+            3
+        )
+
+    def test_background_reload(self):
+        """A stale catalogue is served while a thread builds the new one"""
+        catalogue = get_catalogue()
+        reloaded = threading.Event()
+
+        class Catalogue:
+            def __init__(self):
+                reloaded.wait(5)
+
+        with mock.patch('location.catalogue.LocationCatalogue', Catalogue), \
+                mock.patch('location.catalogue.get_versions', return_value={}):
+            self.assertIs(get_catalogue(), catalogue)
+            # Only one reload at a time
+            self.assertIs(get_catalogue(), catalogue)
+            reloaded.set()
+            catalogue_module._reloader.join()
+        self.assertIsInstance(catalogue_module._catalogue, Catalogue)
+
+
+class TrendingTest(TestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        self.client = Client()
+        self.country = Country.objects.create(
+            name="Trend Country", code="TX", phone_code="+97",
+            search_text="Trend Country"
+        )
+        self.other_country = Country.objects.create(
+            name="Other Country", code="OX", phone_code="+96",
+            search_text="Other Country"
+        )
+        self.old = City.objects.create(
+            name="Trend Aaa", country=self.country,
+            search_text="Trend Aaa,Trend Country"
+        )
+        self.new = City.objects.create(
+            name="Trend Bbb", country=self.country,
+            search_text="Trend Bbb,Trend Country"
+        )
+        self.other = City.objects.create(
+            name="Trend Ccc", country=self.other_country,
+            search_text="Trend Ccc,Other Country"
+        )
+        self.hour = current_hour()
+        LocationSearchBucket.objects.bulk_create([
+            # 8 searches two days ago weigh 2 with a 24h half life
+            LocationSearchBucket(
+                location_type='city', location_id=self.old.pk,
+                country_id=self.country.pk, hour=self.hour - 48, count=8
+            ),
+            LocationSearchBucket(
+                location_type='city', location_id=self.new.pk,
+                country_id=self.country.pk, hour=self.hour, count=3
+            ),
+            LocationSearchBucket(
+                location_type='city', location_id=self.other.pk,
+                country_id=self.other_country.pk, hour=self.hour, count=5
+            ),
+        ])
+
+    def test_select_adds_to_buckets(self):
+        airport = Airport.objects.create(
+            name="Trend Airport", code="TRX", country=self.country,
+            city=self.new, search_text="Trend Airport,Trend Bbb,Trend Country"
+        )
+        self.client.post(reverse('airports-select', args=[airport.pk]))
+        self.client.post(reverse('airports-select', args=[airport.pk]))
+
+        buckets = LocationSearchBucket.objects.filter(hour=self.hour)
+        self.assertEqual(
+            buckets.get(location_type='airport', location_id=airport.pk).count, 2
+        )
+        self.assertEqual(
+            buckets.get(location_type='city', location_id=self.new.pk).count, 5
+        )
+        country = buckets.get(location_type='country', location_id=self.country.pk)
+        self.assertEqual((country.count, country.country_id), (2, self.country.pk))
+
+    def test_trending_endpoint(self):
+        response = self.client.get(reverse('cities-trending'))
+        self.assertEqual(
+            [(item['id'], item['trend_score']) for item in response.data],
+            [(self.other.pk, 5.0), (self.new.pk, 3.0), (self.old.pk, 2.0)]
+        )
+
+        response = self.client.get(
+            reverse('cities-trending'), {'country_code': 'TX', 'limit': 1}
+        )
+        self.assertEqual([item['id'] for item in response.data], [self.new.pk])
+
+        response = self.client.get(reverse('cities-trending'), {'limit': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_rank_trending(self):
+        response = self.client.get(reverse('cities-search'), {'q': 'trend'})
+        self.assertEqual(
+            [item['id'] for item in response.data],
+            [self.old.pk, self.new.pk, self.other.pk]
+        )
+
+        response = self.client.get(
+            reverse('cities-search'), {'q': 'trend', 'rank': 'trending'}
+        )
+        self.assertEqual(
+            [item['id'] for item in response.data],
+            [self.other.pk, self.new.pk, self.old.pk]
+        )
+
+        response = self.client.get(
+            reverse('cities-search'), {'q': 'trend', 'rank': 'popular'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rollup(self):
+        day = (self.hour - 100) // 24 * 24
+        LocationSearchBucket.objects.bulk_create([
+            LocationSearchBucket(
+                location_type='city', location_id=self.old.pk,
+                country_id=self.country.pk, hour=day + offset, count=1
+            )
+            for offset in (0, 3, 5)
+        ] + [
+            LocationSearchBucket(
+                location_type='city', location_id=self.old.pk,
+                country_id=self.country.pk, hour=self.hour - 24 * 40, count=1
+            )
+        ])
+
+        merged, deleted = rollup_buckets(self.hour)
+        self.assertEqual((merged, deleted), (3, 1))
+        # Stored at the mean hour of the merged searches, 8 / 3 rounded
+        self.assertEqual(
+            LocationSearchBucket.objects.get(
+                location_id=self.old.pk, hour__lt=self.hour - 48
+            ).hour,
+            day + 3
+        )
+        self.assertEqual(
+            LocationSearchBucket.objects.get(location_id=self.old.pk, hour=day + 3).count,
+            3
+        )
+        # Recent buckets are left alone
+        self.assertEqual(LocationSearchBucket.objects.count(), 4)
+
+        out = StringIO()
+        call_command('rollup_search_buckets', stdout=out)
+        self.assertIn('Merged 0 hourly buckets', out.getvalue())
+
+
+class SearchCountsTest(APITestCase):
+    databases = {'default', 'logs'}
+
+    def setUp(self):
+        self.country = Country.objects.create(
+            name="Bulk Country", code="BX", phone_code="+95",
+            search_text="Bulk Country"
+        )
+        self.city = City.objects.create(
+            name="Bulk City", country=self.country,
+            search_text="Bulk City,Bulk Country"
+        )
+        self.airport = Airport.objects.create(
+            name="Bulk Airport", code="BLK", country=self.country,
+            city=self.city, search_text="Bulk Airport,Bulk City,Bulk Country"
+        )
+        self.url = reverse('search-counts')
+
+    def test_requires_authentication(self):
+        response = self.client.post(
+            self.url, {'counts': [{'model': 'city', 'id': self.city.pk, 'delta': 1}]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.city.refresh_from_db()
+        self.assertEqual(self.city.search_count, 0)
+
+    def test_bulk_counts(self):
+        self.client.force_authenticate(User.objects.create_user('feed'))
+        counts = [
+            {'model': 'airport', 'id': self.airport.pk, 'delta': 3},
+            {'model': 'city', 'id': self.city.pk, 'delta': 2},
+            {'model': 'airport', 'id': self.airport.pk, 'delta': 1},
+            {'model': 'airport', 'id': 999999, 'delta': 5},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {'counts': counts}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'applied': 3,
+            'missing': [{'model': 'airport', 'id': 999999, 'delta': 5}],
+        })
+        # One UPDATE per model, however many entries
+        updates = [
+            query for query in queries
+            if query['sql'].startswith('UPDATE') and 'search_count' in query['sql']
+        ]
+        self.assertEqual(len(updates), 3)
+
+        for location, count in [(self.airport, 4), (self.city, 6), (self.country, 6)]:
+            location.refresh_from_db()
+            self.assertEqual(location.search_count, count)
+        self.assertEqual(
+            LocationSearchBucket.objects.get(
+                location_type='country', location_id=self.country.pk
+            ).count,
+            6
+        )
+
+        response = self.client.post(
+            self.url, {'counts': [{'model': 'station', 'id': 1, 'delta': 0}]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_duplicated_missing_entries(self):
+        """Every given entry of a missing location is reported, none applied"""
+        self.client.force_authenticate(User.objects.create_user('feed'))
+        counts = [
+            {'model': 'city', 'id': 999999, 'delta': 2},
+            {'model': 'city', 'id': self.city.pk, 'delta': 1},
+            {'model': 'city', 'id': 999999, 'delta': 3},
+        ]
+        response = self.client.post(self.url, {'counts': counts}, format='json')
+        self.assertEqual(response.data, {
+            'applied': 1,
+            'missing': [
+                {'model': 'city', 'id': 999999, 'delta': 2},
+                {'model': 'city', 'id': 999999, 'delta': 3},
+            ],
+        })
+        self.city.refresh_from_db()
+        self.assertEqual(self.city.search_count, 1)
+
+
 class UpdateSearchTextCommandTest(TestCase):
     def setUp(self):
         # Create test data
@@ -248,4 +1383,100 @@ class UpdateSearchTextCommandTest(TestCase):
         
         self.assertEqual(self.country.search_text, "")
         self.assertEqual(self.city.search_text, "")
-        self.assertEqual(self.airport.search_text, "")
\ No newline at end of file
+        self.assertEqual(self.airport.search_text, "")
+
+
+class LocationRegistryTest(TestCase):
+    def setUp(self):
+        self.country = Country.objects.create(
+            name="Test Country",
+            code="TC",
+            phone_code="+99"
+        )
+        self.city = City.objects.create(
+            name="Test City",
+            country=self.country
+        )
+        self.airport = Airport.objects.create(
+            name="Test Airport",
+            code="TST",
+            city=self.city,
+            country=self.country
+        )
+
+    def test_location_types(self):
+        """Test that every concrete location model is registered"""
+        self.assertEqual(location_registry.keys(), ['country', 'city', 'airport'])
+        airport = location_registry.for_model(Airport)
+        self.assertEqual(airport.basename, 'airports')
+        self.assertEqual(
+            [field.name for field in airport.parent_fields], ['city', 'country']
+        )
+        self.assertCountEqual(
+            airport.select_related, ['city', 'city__country', 'country']
+        )
+        # The direct country FK is used instead of city__country
+        self.assertEqual(airport.ancestor_paths, ['city', 'country'])
+
+    def test_build_search_text(self):
+        """Test that search text lists the parents' names"""
+        self.assertEqual(
+            location_registry.build_search_text(self.airport),
+            "Test Airport,Test City,Test Country"
+        )
+
+    def test_increment_search_count(self):
+        """Test that a location and its parents are counted"""
+        self.assertTrue(
+            location_registry.increment_search_count(Airport, self.airport.id)
+        )
+        self.assertFalse(location_registry.increment_search_count(Airport, 999))
+        self.assertFalse(location_registry.increment_search_count(Airport, 'abc'))
+
+        for instance in (self.airport, self.city, self.country):
+            instance.refresh_from_db()
+            self.assertEqual(instance.search_count, 1)
+
+    def test_viewsets(self):
+        """Test that registered models get viewsets and routes"""
+        self.assertIs(location_viewset_for(Country), CountryViewSet)
+        self.assertEqual(reverse('airports-search'), '/api/airports/search/')
+
+    def test_no_parents_no_joins(self):
+        """Models without location parents do not follow other foreign keys"""
+        request = Request(APIRequestFactory().get(reverse('countries-list')))
+        for action in ('list', 'search'):
+            view = CountryViewSet(action=action, request=request, format_kwarg=None)
+            self.assertIs(view.get_queryset().query.select_related, False)
+
+    @isolate_apps('location')
+    def test_transitive_ancestors(self):
+        """Test that a model without its own country FK still counts it"""
+        class Station(BaseLocationModel):
+            city = models.ForeignKey(City, on_delete=models.CASCADE)
+
+        registry = LocationRegistry()
+        registry.populate(BaseLocationModel)
+        station_type = registry.for_model(Station)
+        self.assertEqual(station_type.ancestor_paths, ['city', 'city__country'])
+        self.assertEqual(station_type.ancestor_models, [City, Country])
+
+        station = Station(pk=7, name="Test Station", city=self.city)
+        parent_ids = station_type.ancestor_ids(station)
+        self.assertEqual(parent_ids, [self.city.pk, self.country.pk])
+
+        # Station has no table, only its ancestors are written
+        increment = registry._increment
+        with mock.patch.object(
+            registry, '_increment',
+            side_effect=lambda model, pk: model is Station or increment(model, pk)
+        ):
+            registry.increment_chain(station_type, station.pk, parent_ids)
+
+        for instance in (self.city, self.country):
+            instance.refresh_from_db()
+            self.assertEqual(instance.search_count, 1)
+        bucket = LocationSearchBucket.objects.get(
+            location_type='country', location_id=self.country.pk
+        )
+        self.assertEqual(bucket.country_id, self.country.pk)
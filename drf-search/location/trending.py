@@ -0,0 +1,175 @@
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F, FloatField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Power
+
+from .models import LocationSearchBucket
+
+HOUR = 3600
+DAY_HOURS = 24
+# Rows per INSERT, 5 parameters each
+BATCH_SIZE = 100
+
+
+def get_trending_config():
+    return {
+        'HALF_LIFE_HOURS': 24,
+        'ROLLUP_AFTER_HOURS': 48,
+        'RETENTION_HOURS': 24 * 30,
+        **getattr(settings, 'TRENDING', {}),
+    }
+
+
+def current_hour(now=None):
+    return int((time.time() if now is None else now) // HOUR)
+
+
+def record_searches(location_type, pk, parent_ids, hour=None):
+    """
+    Adds one search to the current hour of a location and its parents, in
+    one INSERT ... ON CONFLICT statement.
+    """
+    add_counts(search_rows(location_type, pk, parent_ids, hour))
+
+
+def search_rows(location_type, pk, parent_ids, hour=None, count=1):
+    """add_counts() rows for a location and its ancestors."""
+    hour = current_hour() if hour is None else hour
+    country_id = _country_id(location_type, pk, parent_ids)
+    rows = [(location_type.key, pk, _own_country(location_type.model, pk, country_id), hour, count)]
+    for model, parent_id in zip(location_type.ancestor_models, parent_ids):
+        if parent_id is not None:
+            rows.append((
+                model._meta.model_name, parent_id,
+                _own_country(model, parent_id, country_id), hour, count
+            ))
+    return rows
+
+
+def add_counts(rows):
+    """Upserts (location_type, location_id, country_id, hour, count) rows."""
+    if not rows:
+        return
+    using = router.db_for_write(LocationSearchBucket)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = quote(LocationSearchBucket._meta.db_table)
+    columns = ', '.join(
+        quote(name)
+        for name in ('location_type', 'location_id', 'country_id', 'hour', 'count')
+    )
+    conflict = ', '.join(quote(name) for name in ('location_type', 'location_id', 'hour'))
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            values = ', '.join(['(%s, %s, %s, %s, %s)'] * len(batch))
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) VALUES {values} '
+                f'ON CONFLICT ({conflict}) DO UPDATE SET '
+                f'{quote("count")} = {table}.{quote("count")} + excluded.{quote("count")}',
+                [value for row in batch for value in row]
+            )
+
+
+def _country_id(location_type, pk, parent_ids):
+    if location_type.model._meta.model_name == 'country':
+        return pk
+    for model, parent_id in zip(location_type.ancestor_models, parent_ids):
+        if model._meta.model_name == 'country':
+            return parent_id
+    return None
+
+
+def _own_country(model, pk, country_id):
+    return pk if model._meta.model_name == 'country' else country_id
+
+
+def decayed_score(hour=None, half_life=None):
+    """
+    Expression for sum(count * 0.5 ** (age in hours / half life)) over a
+    LocationSearchBucket queryset.
+    """
+    hour = current_hour() if hour is None else hour
+    half_life = half_life or get_trending_config()['HALF_LIFE_HOURS']
+    return Sum(
+        F('count') * Power(
+            Value(0.5), (Value(hour) - F('hour')) / Value(float(half_life))
+        ),
+        output_field=FloatField(),
+    )
+
+
+def trend_score_subquery(location_type, hour=None):
+    """Decayed score of the outer location, for annotate() and order_by()."""
+    buckets = (
+        LocationSearchBucket.objects
+        .filter(location_type=location_type.key, location_id=OuterRef('pk'))
+        .values('location_id')
+        .annotate(score=decayed_score(hour))
+        .values('score')
+    )
+    return Coalesce(Subquery(buckets, output_field=FloatField()), Value(0.0))
+
+
+def trending_scores(location_type, country_ids=None, limit=10, hour=None):
+    """[(location id, score)] with the highest decayed score first."""
+    buckets = LocationSearchBucket.objects.filter(location_type=location_type.key)
+    if country_ids is not None:
+        buckets = buckets.filter(country_id__in=country_ids)
+    return list(
+        buckets
+        .values('location_id')
+        .annotate(score=decayed_score(hour))
+        .order_by('-score', 'location_id')
+        .values_list('location_id', 'score')[:limit]
+    )
+
+
+def rollup_buckets(hour=None):
+    """
+    Merges hourly buckets older than ROLLUP_AFTER_HOURS into daily ones and
+    deletes buckets older than RETENTION_HOURS. Returns (merged, deleted).
+
+    A daily bucket is stored at the count-weighted mean hour of its day, not
+    at its start, so merging does not age late searches by up to a day.
+    """
+    config = get_trending_config()
+    hour = current_hour() if hour is None else hour
+    using = router.db_for_write(LocationSearchBucket)
+    buckets = LocationSearchBucket.objects.using(using)
+
+    with transaction.atomic(using=using):
+        deleted, _ = buckets.filter(
+            hour__lt=hour - config['RETENTION_HOURS']
+        ).delete()
+
+        days = defaultdict(list)
+        for pk, location_type, location_id, country_id, bucket_hour, count in (
+            buckets.filter(hour__lt=hour - config['ROLLUP_AFTER_HOURS'])
+            .values_list(
+                'pk', 'location_type', 'location_id', 'country_id', 'hour', 'count'
+            )
+            .iterator()
+        ):
+            key = (location_type, location_id, country_id, bucket_hour // DAY_HOURS)
+            days[key].append((pk, bucket_hour, count))
+
+        hourly_ids = []
+        rows = []
+        for (location_type, location_id, country_id, _), day_buckets in days.items():
+            # A single bucket is a day merged by an earlier run
+            if len(day_buckets) < 2:
+                continue
+            total = sum(count for _, _, count in day_buckets)
+            weighted = sum(bucket_hour * count for _, bucket_hour, count in day_buckets)
+            mean_hour = round(weighted / total) if total else day_buckets[0][1]
+            rows.append((location_type, location_id, country_id, mean_hour, total))
+            hourly_ids.extend(pk for pk, _, _ in day_buckets)
+
+        for start in range(0, len(hourly_ids), 500):
+            buckets.filter(pk__in=hourly_ids[start:start + 500]).delete()
+        add_counts(rows)
+    return len(hourly_ids), deleted
@@ -1,12 +1,17 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CountryViewSet, CityViewSet, AirportViewSet
+from .registry import location_registry
+from .views import location_viewset_for, search_counts
 
 router = DefaultRouter()
-router.register(r'countries', CountryViewSet, basename='countries')
-router.register(r'cities', CityViewSet, basename='cities')
-router.register(r'airports', AirportViewSet, basename='airports')
+for location_type in location_registry:
+    router.register(
+        location_type.basename,
+        location_viewset_for(location_type.model),
+        basename=location_type.basename
+    )
 
 urlpatterns = [
+    path('search-counts/', search_counts, name='search-counts'),
     path('', include(router.urls)),
 ] 
\ No newline at end of file
@@ -0,0 +1,129 @@
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import LocationTableVersion
+
+
+def table_key(model):
+    return model._meta.model_name
+
+
+def bump_versions(*models):
+    """Marks the tables of the given models as changed, in one UPDATE."""
+    keys = sorted({table_key(model) for model in models})
+    updated = LocationTableVersion.objects.filter(table__in=keys).update(
+        version=F('version') + 1, updated_at=timezone.now()
+    )
+    if updated < len(keys):
+        existing = set(
+            LocationTableVersion.objects.filter(table__in=keys)
+            .values_list('table', flat=True)
+        )
+        LocationTableVersion.objects.bulk_create(
+            [
+                LocationTableVersion(table=key, version=1)
+                for key in keys if key not in existing
+            ],
+            ignore_conflicts=True
+        )
+
+
+def get_versions(models):
+    """{table: (version, updated_at)} for the given models, one query."""
+    keys = [table_key(model) for model in models]
+    versions = {key: (0, None) for key in keys}
+    for table, version, updated_at in LocationTableVersion.objects.filter(
+        table__in=keys
+    ).values_list('table', 'version', 'updated_at'):
+        versions[table] = (version, updated_at)
+    return versions
+
+
+def bump_instance_version(sender, instance, **kwargs):
+    """post_save/post_delete receiver for location models."""
+    bump_versions(sender)
+
+
+def get_count_window():
+    """Seconds search counts in conditional responses may lag behind."""
+    return getattr(settings, 'CONDITIONAL_RESPONSES', {}).get('COUNT_WINDOW', 60)
+
+
+def conditional_response(view_method):
+    """
+    Adds ETag, Last-Modified and Cache-Control to a viewset action and
+    answers If-None-Match with 304 before the action runs. The ETag is
+    derived from the versions of the tables returned by
+    `get_version_models()`, so it changes whenever one of them is saved.
+
+    Search counts do not bump the versions (that would change the ETag on
+    almost every request), the ETag also changes every COUNT_WINDOW seconds
+    so the counts in a response are at most that old.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        config = getattr(settings, 'CONDITIONAL_RESPONSES', {})
+        if not config.get('ENABLED', True):
+            return view_method(self, request, *args, **kwargs)
+
+        versions = get_versions(self.get_version_models())
+        modified = [
+            updated_at.timestamp() for _, updated_at in versions.values()
+            if updated_at is not None
+        ]
+        count_window = get_count_window()
+        window = None
+        if count_window:
+            window = int(time.time() // count_window)
+            modified.append(window * count_window)
+        etag = make_etag(request, versions, window)
+        last_modified = int(max(modified)) if modified else None
+
+        if is_not_modified(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = view_method(self, request, *args, **kwargs)
+
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(
+                response, **config.get('CACHE_CONTROL', {'no_cache': True})
+            )
+        return response
+
+    return wrapper
+
+
+def make_etag(request, versions, window=None):
+    accepted = getattr(request, 'accepted_media_type', '')
+    tables = ','.join(
+        f'{table}:{version}' for table, (version, _) in sorted(versions.items())
+    )
+    digest = hashlib.blake2b(
+        f'{request.get_full_path()}|{accepted}|{tables}|{window}'.encode(),
+        digest_size=16
+    ).hexdigest()
+    return f'"{digest}"'
+
+
+def is_not_modified(request, etag):
+    # If-Modified-Since is not answered: Last-Modified has one second
+    # resolution and would hide a write made in the same second, every
+    # response carries an ETag to revalidate with instead
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    # '*' is not answered either: it is checked before the action runs and
+    # would turn a missing location into a 304
+    return etag in parse_etags(if_none_match)
@@ -1,21 +1,187 @@
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from django.db.models import Sum, F
+from django.conf import settings
+from django.db.models import Q, Sum, F
+from django.http import Http404, HttpResponse
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
+from .catalogue import get_catalogue
+from .metrics import get_latency_histogram, get_search_counter
 from .models import Country, City, Airport
+from .profiling import profile_section
+from .registry import location_registry
+from .search_cache import cached_search, cached_search_ids
+from .selection import delete_selection, set_selection
+from .singleflight import SingleFlight
+from .trending import trending_scores
 from .serializers import (
     CountrySerializer, CitySerializer, AirportSerializer,
     CountrySearchRatioSerializer, CountryCitySearchSerializer,
-    MostSearchedCitiesSerializer
+    MostSearchedCitiesSerializer, LocationResolveSerializer,
+    SearchCountsSerializer, location_serializer_for
 )
+from .versions import conditional_response
 
 # Create your views here.
 
+search_flight = SingleFlight()
+
+
+def metrics(request):
+    """Latency histograms and search counters of all worker processes in
+    Prometheus text format, only for LATENCY_METRICS['ALLOWED_IPS']."""
+    allowed_ips = getattr(settings, 'LATENCY_METRICS', {}).get(
+        'ALLOWED_IPS', ['127.0.0.1', '::1']
+    )
+    # REMOTE_ADDR only, X-Forwarded-For is set by the client
+    if allowed_ips is not None and request.META.get('REMOTE_ADDR') not in allowed_ips:
+        raise Http404
+    return HttpResponse(
+        get_latency_histogram().render() + get_search_counter().render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+@swagger_auto_schema(
+    method='post',
+    operation_description=(
+        "Add search counts collected elsewhere (offline apps, partner feeds) "
+        "in one request instead of replaying `select` calls. Parents are "
+        "counted too; entries for unknown locations are skipped and listed "
+        "under `missing`"
+    ),
+    request_body=SearchCountsSerializer,
+    responses={
+        200: openapi.Response(
+            description="Counts applied",
+            examples={
+                "application/json": {
+                    "applied": 2,
+                    "missing": [{"model": "airport", "id": 42, "delta": 3}]
+                }
+            }
+        ),
+        400: "Bad Request - invalid entries or too many",
+        403: "Not authenticated"
+    }
+)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def search_counts(request):
+    serializer = SearchCountsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    entries = [
+        (entry['model'], entry['id'], entry['delta'])
+        for entry in serializer.validated_data['counts']
+    ]
+    missing = location_registry.apply_search_counts(entries)
+    return Response({
+        'applied': len(entries) - len(missing),
+        'missing': [
+            {'model': location_type.key, 'id': pk, 'delta': delta}
+            for location_type, pk, delta in missing
+        ]
+    })
+
+
 class BaseLocationViewSet(viewsets.ModelViewSet):
-    def get_cookie_key(self):
-        return f'selected_{self.basename}'
+    # Actions accepting ?fields= and ?expand=
+    sparse_field_actions = ('list', 'retrieve', 'search', 'resolve', 'trending')
+    # Values of ?rank= on search, besides the default name ordering
+    search_rankings = ('trending',)
+
+    def get_location_type(self):
+        return location_registry.for_model(self.queryset.model)
+
+    def get_version_models(self):
+        # Responses nest the parents, and their parents
+        location_type = self.get_location_type()
+        return [location_type.model] + location_type.ancestor_models
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields, expand = self.get_field_selection()
+        # Serializers nest the parents, load the whole chain in one query
+        paths = self.get_location_type().select_related
+        if expand is not None:
+            # Only join the requested parents and only read the requested columns
+            paths = [path for path in paths if path.split('__')[0] in expand]
+        # select_related() without paths would follow every foreign key
+        if paths:
+            queryset = queryset.select_related(*paths)
+        if fields is not None:
+            only = set(fields)
+            if self.action == 'resolve' and self.has_code():
+                only.add('code')
+            queryset = queryset.only(*only)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        fields, expand = self.get_field_selection()
+        if expand is not None:
+            kwargs.setdefault('fields', fields)
+            kwargs.setdefault('expand', expand)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_field_selection(self):
+        """
+        (fields, expand) from the query string, (None, None) when neither is
+        given. Once either is given, parents are only nested if expanded.
+        """
+        if hasattr(self, '_field_selection'):
+            return self._field_selection
+
+        self._field_selection = (None, None)
+        if (
+            getattr(self, 'swagger_fake_view', False)
+            or self.action not in self.sparse_field_actions
+        ):
+            return self._field_selection
+
+        params = self.request.query_params
+        if 'fields' not in params and 'expand' not in params:
+            return self._field_selection
+
+        available = self.get_serializer_class().Meta.fields
+        parents = {field.name for field in self.get_location_type().parent_fields}
+        fields = self._parse_names(params, 'fields', available)
+        expand = self._parse_names(params, 'expand', parents) or set()
+        if fields is not None:
+            expand &= fields
+        self._field_selection = (fields, expand)
+        return self._field_selection
+
+    def _parse_names(self, params, name, available):
+        if name not in params:
+            return None
+        names = {value.strip() for value in params[name].split(',') if value.strip()}
+        unknown = names - set(available)
+        if unknown:
+            raise ValidationError({
+                name: f"Unknown fields: {', '.join(sorted(unknown))}. "
+                      f"Choose from: {', '.join(available)}"
+            })
+        return names
+
+    def serialize(self, instance, **kwargs):
+        # Timed separately so the profiling middleware can report it
+        with profile_section(self.request, 'serialize'):
+            return self.get_serializer(instance, **kwargs).data
+
+    @conditional_response
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.serialize(page, many=True))
+        return Response(self.serialize(queryset, many=True))
+
+    @conditional_response
+    def retrieve(self, request, *args, **kwargs):
+        return Response(self.serialize(self.get_object()))
 
     @swagger_auto_schema(
         operation_description="Select a location and store it in cookies",
@@ -35,16 +201,12 @@ class BaseLocationViewSet(viewsets.ModelViewSet):
         instance = self.get_object()
         response = Response({'status': 'Location selected'})
         
-        # Set cookie for selected location
-        response.set_cookie(
-            self.get_cookie_key(),
-            pk,
-            max_age=86400,  # 24 hours
-            httponly=True
-        )
+        # Replaces any previously selected location. The middleware starts
+        # the dedup window with it, it is counted here
+        response.selection = set_selection(response, instance)
         
-        # Increment search count
-        instance.increment_search_count()
+        # Increment search count of the location and its parents
+        location_registry.increment_instance_search_count(instance)
         
         return response
 
@@ -64,7 +226,7 @@ class BaseLocationViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['post'])
     def deselect(self, request):
         response = Response({'status': 'Location deselected'})
-        response.delete_cookie(self.get_cookie_key())
+        delete_selection(response)
         return response
 
     @swagger_auto_schema(
@@ -76,6 +238,16 @@ class BaseLocationViewSet(viewsets.ModelViewSet):
                 description="Search query string",
                 type=openapi.TYPE_STRING,
                 required=True
+            ),
+            openapi.Parameter(
+                'rank',
+                openapi.IN_QUERY,
+                description=(
+                    "'trending' to list recently searched locations first "
+                    "instead of ordering by name"
+                ),
+                type=openapi.TYPE_STRING,
+                enum=['trending']
             )
         ],
         responses={
@@ -83,11 +255,198 @@ class BaseLocationViewSet(viewsets.ModelViewSet):
         }
     )
     @action(detail=False, methods=['get'])
+    @conditional_response
     def search(self, request):
         query = request.query_params.get('q', '')
-        queryset = self.get_queryset().search(query)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        rank = self.get_search_rank()
+        queryset = self.get_queryset()
+        if not getattr(settings, 'SEARCH_COALESCING', {}).get('ENABLED', True):
+            return Response(self.search_data(queryset, query, rank))
+
+        # Identical concurrent searches in this worker share one query and
+        # serialization
+        fields, expand = self.get_field_selection()
+        key = (
+            self.get_location_type().key,
+            queryset.get_search_terms(query),
+            rank,
+            None if fields is None else frozenset(fields),
+            None if expand is None else frozenset(expand),
+        )
+        data, shared = search_flight.do(
+            key, lambda: self.search_data(queryset, query, rank)
+        )
+        get_search_counter().inc(
+            model=self.get_location_type().key,
+            outcome='coalesced' if shared else 'executed'
+        )
+        return Response(data)
+
+    def get_search_rank(self):
+        rank = self.request.query_params.get('rank') or None
+        if rank is not None and rank not in self.search_rankings:
+            raise ValidationError({
+                'rank': f"Unknown ranking '{rank}'. "
+                        f"Choose from: {', '.join(self.search_rankings)}"
+            })
+        return rank
+
+    def search_data(self, queryset, query, rank=None):
+        catalogue = get_catalogue()
+        if catalogue is None:
+            return self.serialize(cached_search(queryset, query, rank), many=True)
+
+        # Only the ids come from the database (or cache/index)
+        ids = cached_search_ids(queryset, query, rank)
+        with profile_section(self.request, 'serialize'):
+            return catalogue.serialize_ids(
+                queryset.model, ids, *self.get_field_selection()
+            )
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Resolve many locations by id or code in one request. Results "
+            "are grouped: the found ids in the order given, then the found "
+            "codes in the order given. Codes are matched case-insensitively, "
+            "unknown ids and codes are listed under `missing` as given"
+        ),
+        request_body=LocationResolveSerializer,
+        responses={
+            200: openapi.Response(
+                description="Resolved locations",
+                examples={
+                    "application/json": {
+                        "results": [{"id": 1, "name": "Istanbul Airport"}],
+                        "missing": {"ids": [42], "codes": ["XXX"]}
+                    }
+                }
+            ),
+            400: "Bad Request - no ids or codes, or too many"
+        }
+    )
+    @action(detail=False, methods=['post'])
+    def resolve(self, request):
+        serializer = LocationResolveSerializer(
+            data=request.data,
+            context={'code_field': self.queryset.get_code_field()}
+        )
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        # Looked up normalized, missing codes are reported as given
+        given_codes = serializer.validated_data['codes']
+        codes = serializer.validated_data['code_keys']
+
+        catalogue = get_catalogue()
+        if catalogue is not None:
+            return Response(
+                self.resolve_from_catalogue(catalogue, ids, codes, given_codes)
+            )
+
+        # One query for everything, ordered afterwards
+        condition = Q(pk__in=ids)
+        if codes:
+            condition |= Q(code__in=codes)
+        locations = list(self.get_queryset().filter(condition))
+        by_id = {location.pk: location for location in locations}
+        by_code = {
+            location.code: location for location in locations if codes
+        }
+
+        results = [by_id[pk] for pk in ids if pk in by_id]
+        results += [by_code[code] for code in codes if code in by_code]
+        return Response({
+            'results': self.serialize(results, many=True),
+            'missing': {
+                'ids': [pk for pk in ids if pk not in by_id],
+                'codes': [
+                    given for given, code in zip(given_codes, codes)
+                    if code not in by_code
+                ],
+            }
+        })
+
+    def resolve_from_catalogue(self, catalogue, ids, codes, given_codes):
+        table = catalogue.table(self.queryset.model)
+        id_rows = [table.row_for_id(pk) for pk in ids]
+        code_rows = [table.row_for_code(code) for code in codes]
+        fields, expand = self.get_field_selection()
+        with profile_section(self.request, 'serialize'):
+            results = [
+                table.serialize(row, catalogue, fields, expand)
+                for row in id_rows + code_rows if row is not None
+            ]
+        return {
+            'results': results,
+            'missing': {
+                'ids': [pk for pk, row in zip(ids, id_rows) if row is None],
+                'codes': [
+                    given for given, row in zip(given_codes, code_rows) if row is None
+                ],
+            }
+        }
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Locations searched the most recently. Every search adds to an "
+            "hourly bucket and older buckets count less: a bucket loses half "
+            "of its weight every TRENDING['HALF_LIFE_HOURS'] hours"
+        ),
+        manual_parameters=[
+            openapi.Parameter(
+                'country_code',
+                openapi.IN_QUERY,
+                description="Only locations in these countries (comma-separated)",
+                type=openapi.TYPE_STRING,
+                example="TR,UK"
+            ),
+            openapi.Parameter(
+                'limit',
+                openapi.IN_QUERY,
+                description="Number of locations, at most 100 (default 10)",
+                type=openapi.TYPE_INTEGER
+            )
+        ],
+        responses={
+            200: openapi.Response(
+                description="Trending locations, highest trend_score first",
+                examples={
+                    "application/json": [
+                        {"id": 1, "name": "Istanbul", "trend_score": 41.5}
+                    ]
+                }
+            ),
+            400: "Bad Request - invalid limit"
+        }
+    )
+    @action(detail=False, methods=['get'])
+    def trending(self, request):
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= 100:
+            raise ValidationError({'limit': 'Must be a number from 1 to 100.'})
+
+        country_ids = None
+        country_codes = request.query_params.get('country_code', '').split(',')
+        country_codes = [code.strip() for code in country_codes if code.strip()]
+        if country_codes:
+            country_ids = Country.objects.filter(
+                code__in=country_codes
+            ).values_list('pk', flat=True)
+
+        scores = trending_scores(self.get_location_type(), country_ids, limit)
+        locations = self.get_queryset().in_bulk([pk for pk, score in scores])
+        results = [
+            (locations[pk], score) for pk, score in scores if pk in locations
+        ]
+        data = self.serialize([location for location, score in results], many=True)
+        for item, (location, score) in zip(data, results):
+            item['trend_score'] = round(score, 2)
+        return Response(data)
+
+    def has_code(self):
+        return self.queryset.get_code_field() is not None
 
 
 class CountryViewSet(BaseLocationViewSet):
@@ -95,6 +454,13 @@ class CountryViewSet(BaseLocationViewSet):
     serializer_class = CountrySerializer
     basename = 'countries'
 
+    def get_version_models(self):
+        if self.action == 'most_searched_cities':
+            return [Country, City]
+        if self.action == 'search_ratio':
+            return [Country, City, Airport]
+        return super().get_version_models()
+
     @swagger_auto_schema(
         operation_description="Get most searched cities for specified countries",
         manual_parameters=[
@@ -113,6 +479,7 @@ class CountryViewSet(BaseLocationViewSet):
         }
     )
     @action(detail=False, methods=['get'])
+    @conditional_response
     def most_searched_cities(self, request):
         country_codes = request.query_params.get('country_code', '').split(',')
         country_codes = [code.strip() for code in country_codes if code.strip()]
@@ -124,9 +491,10 @@ class CountryViewSet(BaseLocationViewSet):
             )
 
         countries = Country.objects.filter(code__in=country_codes)
-        serializer = MostSearchedCitiesSerializer(countries, many=True)
+        with profile_section(request, 'serialize'):
+            data = MostSearchedCitiesSerializer(countries, many=True).data
         
-        return Response(serializer.data)
+        return Response(data)
 
     @swagger_auto_schema(
         operation_description="Get search ratio statistics for specified countries",
@@ -146,6 +514,7 @@ class CountryViewSet(BaseLocationViewSet):
         }
     )
     @action(detail=False, methods=['get'])
+    @conditional_response
     def search_ratio(self, request):
         country_codes = request.query_params.get('country_code', '').split(',')
         country_codes = [code.strip() for code in country_codes if code.strip()]
@@ -179,10 +548,12 @@ class CountryViewSet(BaseLocationViewSet):
             }
             result.append(data)
 
-        serializer = CountrySearchRatioSerializer(data=result, many=True)
-        serializer.is_valid()
+        with profile_section(request, 'serialize'):
+            serializer = CountrySearchRatioSerializer(data=result, many=True)
+            serializer.is_valid()
+            data = serializer.data
         
-        return Response(serializer.data)
+        return Response(data)
 
 
 class CityViewSet(BaseLocationViewSet):
@@ -193,3 +564,24 @@ class CityViewSet(BaseLocationViewSet):
 class AirportViewSet(BaseLocationViewSet):
     queryset = Airport.objects.all()
     serializer_class = AirportSerializer
+
+
+def build_location_viewset(model):
+    """Viewset for location models without an explicit one."""
+    return type(f'{model.__name__}ViewSet', (BaseLocationViewSet,), {
+        'queryset': model.objects.all(),
+        'serializer_class': location_serializer_for(model),
+    })
+
+
+def location_viewset_for(model):
+    if model not in LOCATION_VIEWSETS:
+        LOCATION_VIEWSETS[model] = build_location_viewset(model)
+    return LOCATION_VIEWSETS[model]
+
+
+LOCATION_VIEWSETS = {
+    Country: CountryViewSet,
+    City: CityViewSet,
+    Airport: AirportViewSet,
+}